@@ -0,0 +1,471 @@
+"""Offline benchmark for the bot.
+
+Drives the handlers from main.py with synthetic updates through a fake Telegram Bot API and
+replaces Google CSE, Bing, DDG, Wikipedia, OpenAI and Anthropic with local HTTP stand-ins
+(configurable latency and failure injection). Quantum scenarios run on local Aer.
+
+    python bench.py --requests 100 --concurrency 16 --out bench.json
+    python bench.py --scenarios web,ask --set openai.fail=0.2 --set google.latency=0.5
+    python bench.py --compare bench.json --max-regression 0.2
+    python bench.py --aer all --aer-out aer_profiles.json   # Aer profile defaults -> QUANTUM_AER_PROFILES_FILE
+"""
+import os, re, sys, json, time, random, asyncio, argparse, itertools, logging, platform, subprocess, tempfile, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs, unquote
+
+OWNER_ID = 424242
+WORDS = "квантовый бит суперпозиция запутанность измерение схема вентиль кубит амплитуда фаза".split()
+
+# ===== Local stand-ins =====
+class Service:
+    """One HTTP stand-in on 127.0.0.1:<random port>; latency ± jitter, `fail` share answered with 500."""
+
+    def __init__(self, name: str, route: Callable, latency: float = 0.05, jitter: float = 0.0, fail: float = 0.0):
+        self.name, self.route = name, route
+        self.latency, self.jitter, self.fail = latency, jitter, fail
+        self.requests = 0
+        self.failures = 0
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                service.handle(self, None)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                service.handle(self, _body(raw, self.headers.get("Content-Type", "")))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def handle(self, h: BaseHTTPRequestHandler, body: Optional[dict]):
+        self.requests += 1
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        url = urlparse(h.path)
+        if random.random() < self.fail:
+            self.failures += 1
+            return _send(h, 500, {"error": {"type": "server_error", "message": "injected failure"}})
+        res = self.route(unquote(url.path), {k: v[0] for k, v in parse_qs(url.query).items()}, body or {})
+        if isinstance(res, tuple):
+            return _send(h, *res)
+        if isinstance(res, dict):
+            return _send(h, 200, res)
+        # Generator -> server-sent events, connection closed at the end
+        h.send_response(200)
+        h.send_header("Content-Type", "text/event-stream")
+        h.send_header("Connection", "close")
+        h.end_headers()
+        h.close_connection = True
+        try:
+            for chunk in res:
+                h.wfile.write(chunk.encode())
+                h.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name=f"bench-{self.name}", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def _body(raw: bytes, ctype: str) -> dict:
+    if not raw:
+        return {}
+    if "json" in ctype:
+        return json.loads(raw)
+    return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+def _send(h: BaseHTTPRequestHandler, status: int, payload):
+    data = json.dumps(payload, ensure_ascii=False).encode()
+    h.send_response(status)
+    h.send_header("Content-Type", "application/json")
+    h.send_header("Content-Length", str(len(data)))
+    h.end_headers()
+    h.wfile.write(data)
+
+def _sse(event: Optional[str], data) -> str:
+    head = f"event: {event}\n" if event else ""
+    return head + "data: " + (data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)) + "\n\n"
+
+def _google(path, query, body):
+    q = query.get("q", "")
+    return {"items": [{"title": f"{q} — результат {i}", "link": f"https://example.org/google/{i}", "snippet": q} for i in range(3)]}
+
+def _bing(path, query, body):
+    q = query.get("q", "")
+    return {"webPages": {"value": [{"name": f"{q} — результат {i}", "url": f"https://example.org/bing/{i}", "snippet": q} for i in range(3)]}}
+
+def _ddg(path, query, body):
+    q = query.get("q", "")
+    return {"AbstractText": f"{q}: краткая справка.", "AbstractURL": "https://example.org/ddg"}
+
+def _wiki(path, query, body):
+    title = path.rsplit("/", 1)[-1]
+    return {"extract": f"{title} — статья-заглушка. " * 5, "content_urls": {"desktop": {"page": f"https://example.org/wiki/{title}"}}}
+
+def _llm(tokens: int, interval: float):
+    # OpenAI and Anthropic stand-ins share the answer text and the per-token streaming pace
+    def answer() -> List[str]:
+        return [random.choice(WORDS) + " " for _ in range(tokens)]
+
+    def openai(path, query, body):
+        if path.endswith("/embeddings"):
+            return {"object": "list", "model": "bench", "usage": {"prompt_tokens": 1, "total_tokens": 1},
+                    "data": [{"object": "embedding", "index": 0, "embedding": [random.random() for _ in range(256)]}]}
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": body.get("model", "bench")}
+        if not body.get("stream"):
+            return {**base, "object": "chat.completion", "usage": {"prompt_tokens": 1, "completion_tokens": tokens, "total_tokens": tokens + 1},
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(answer())}}]}
+
+        def events():
+            for tok in answer():
+                time.sleep(interval)
+                yield _sse(None, {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]})
+            yield _sse(None, {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            yield _sse(None, "[DONE]")
+        return events()
+
+    prefixes = set()
+
+    def prompt_cache(body) -> dict:
+        # Prompt caching stand-in: a prefix ending at a cache_control breakpoint is stored, and a later
+        # request starting with a stored prefix reports it as cache_read_input_tokens (~4 chars per token)
+        def plain(v):
+            if isinstance(v, dict):
+                return {k: plain(x) for k, x in v.items() if k != "cache_control"}
+            return [plain(x) for x in v] if isinstance(v, list) else v
+        system, msgs = plain(body.get("system")), body.get("messages", [])
+        # A string and a single text block are the same prompt
+        msgs = [{**m, "content": [{"type": "text", "text": m["content"]}]} if isinstance(m["content"], str) else m for m in msgs]
+        keys = [json.dumps([system, plain(msgs[:i + 1])], ensure_ascii=False) for i in range(len(msgs))]
+        read = max((len(k) // 4 for k in keys if k in prefixes), default=0)
+        marks = [k for k, m in zip(keys, msgs) if isinstance(m["content"], list) and any("cache_control" in c for c in m["content"])]
+        prefixes.update(marks)
+        return {"cache_read_input_tokens": read, "cache_creation_input_tokens": sum(len(k) // 4 for k in marks) - read if marks else 0}
+
+    def anthropic(path, query, body):
+        usage = {"input_tokens": 1, "output_tokens": tokens, **prompt_cache(body)}
+        msg = {"id": "msg_bench", "type": "message", "role": "assistant", "model": body.get("model", "bench"),
+               "stop_reason": "end_turn", "stop_sequence": None, "usage": usage}
+        if not body.get("stream"):
+            return {**msg, "content": [{"type": "text", "text": "".join(answer())}]}
+
+        def events():
+            yield _sse("message_start", {"type": "message_start", "message": {**msg, "content": [], "stop_reason": None}})
+            yield _sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+            for tok in answer():
+                time.sleep(interval)
+                yield _sse("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": tok}})
+            yield _sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield _sse("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": tokens}})
+            yield _sse("message_stop", {"type": "message_stop"})
+        return events()
+
+    return openai, anthropic
+
+class FakeTelegram:
+    """Bot API stand-in: remembers the latest text of every message per chat."""
+
+    def __init__(self):
+        self.chats: Dict[int, Dict[int, str]] = {}
+        self._ids = itertools.count(1_000_000)
+
+    def route(self, path, query, body):
+        method = path.rsplit("/", 1)[-1]
+        if method == "getMe":
+            return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot",
+                                           "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}}
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(body["chat_id"])
+            message_id = int(body["message_id"]) if "message_id" in body else next(self._ids)
+            self.chats.setdefault(chat_id, {})[message_id] = body.get("text", "")
+            return {"ok": True, "result": {"message_id": message_id, "date": int(time.time()), "text": body.get("text", ""),
+                                           "chat": {"id": chat_id, "type": "private"}}}
+        return {"ok": True, "result": True}
+
+    def replies(self, chat_id: int) -> List[str]:
+        return list(self.chats.get(chat_id, {}).values())
+
+def start_services(args) -> Dict[str, Service]:
+    openai, anthropic = _llm(args.tokens, args.token_interval)
+    tg = FakeTelegram()
+    routes = {"telegram": tg.route, "google": _google, "bing": _bing, "ddg": _ddg, "wiki": _wiki,
+              "openai": openai, "anthropic": anthropic}
+    services = {}
+    for name, route in routes.items():
+        latency = args.tg_latency if name == "telegram" else args.latency
+        services[name] = Service(name, route, latency, args.jitter, 0.0 if name == "telegram" else args.fail)
+    for item in args.set:
+        # --set openai.fail=0.2
+        key, value = item.split("=", 1)
+        name, attr = key.split(".", 1)
+        if name not in services or attr not in ("latency", "jitter", "fail"):
+            raise SystemExit(f"--set {item}: expected <service>.<latency|jitter|fail>=<value>")
+        setattr(services[name], attr, float(value))
+    services["telegram"].fake = tg
+    return {name: s.start() for name, s in services.items()}
+
+def configure_env(services: Dict[str, Service], args):
+    # Must run before main.py is imported: modules read their settings at import time
+    env = {
+        "BOT_TOKEN": "1:bench", "OWNER_ID": str(OWNER_ID), "SECRET_LOGIN": "bench", "SECRET_PASSWORD": "bench",
+        "TELEGRAM_BASE_URL": f"{services['telegram'].url}/bot",
+        "GOOGLE_CSE_KEY": "bench", "GOOGLE_CSE_CX": "bench", "BING_KEY": "bench",
+        "GOOGLE_CSE_URL": f"{services['google'].url}/customsearch/v1",
+        "BING_URL": f"{services['bing'].url}/v7.0/search",
+        "DDG_URL": f"{services['ddg'].url}/",
+        "WIKI_URL": services["wiki"].url + "/{lang}/api/rest_v1/page/summary/",
+        "OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": f"{services['openai'].url}/v1",
+        "ANTHROPIC_API_KEY": "bench", "ANTHROPIC_BASE_URL": services["anthropic"].url,
+        "QUANTUM_JOBS_FILE": os.path.join(tempfile.mkdtemp(prefix="bench-"), "jobs.json"),
+    }
+    os.environ.update(env)
+    os.environ.setdefault("QUANTUM_EXACT_AUTO", "0")  # measure Aer sampling unless asked otherwise
+    for name in ("GOOGLE", "BING", "DDG", "WIKI", "OPENAI", "ANTHROPIC"):
+        os.environ.setdefault(f"{name}_RPS", "0")  # outbound rate limits off unless set explicitly
+    # Never touch real services or persistent caches
+    for key in ("IBM_QUANTUM_TOKEN", "AWS_REGION", "WEB_CACHE_DB", "LLM_CACHE_DB", "QUANTUM_QPY_DIR", "METRICS_PORT"):
+        os.environ.pop(key, None)
+
+# ===== Workloads =====
+def _qasm(n: int, i: int) -> str:
+    # GHZ in OpenQASM 3 with a distinct angle per request, so parsing is not served from the circuit cache
+    gates = " ".join(f"cx q[{k}], q[{k + 1}];" for k in range(n - 1))
+    return f'OPENQASM 3.0; include "stdgates.inc"; qubit[{n}] q; bit[{n}] c; h q[0]; {gates} rz({0.001 * i:.3f}) q[0]; c = measure q;'
+
+def workload(name: str, count: int, args) -> List[str]:
+    qubits = [int(q) for q in args.qubits.split(",")]
+    pool = max(1, int(count * (1 - args.hot)))  # --hot: share of repeated queries (cache hits)
+    q = lambda i: f"{WORDS[i % pool % len(WORDS)]} {i % pool}"
+    texts = {
+        "start": lambda i: "/start",
+        "web": lambda i: f"/web {q(i)}",
+        "google": lambda i: f"/google {q(i)}",
+        "wiki": lambda i: f"/wiki {q(i)}",
+        "ask": lambda i: f"/ask {q(i)}",
+        "chat": lambda i: f"/chat {q(i)}",
+        "quantum": lambda i: ("/quantum preset bell 2" if i % 3 == 0 else
+                              f"/quantum preset {'ghz' if i % 3 == 1 else 'qft'} {qubits[i % len(qubits)]}"),
+        "quantum_exact": lambda i: f"/quantum preset ghz {qubits[i % len(qubits)]} --exact",
+        "qasm": lambda i: f"/quantum run {_qasm(qubits[i % len(qubits)], i)}",
+    }
+    if name not in texts:
+        raise SystemExit(f"unknown scenario {name}; available: {', '.join(texts)}")
+    random.seed(f"{args.seed}:{name}")
+    return [texts[name](i) for i in range(count)]
+
+SCENARIOS = "start,web,google,wiki,ask,chat,quantum,quantum_exact,qasm"
+
+def _pct(data: List[float], q: float) -> Optional[float]:
+    return data[min(len(data) - 1, int(q * len(data)))] if data else None
+
+def _ms(v: Optional[float]) -> Optional[float]:
+    return round(v * 1000, 2) if v is not None else None
+
+class Driver:
+    """Feeds synthetic updates to the Application the same way polling/webhook updates are processed."""
+
+    def __init__(self, app, tg: FakeTelegram):
+        self.app, self.tg = app, tg
+        self._ids = itertools.count(1)
+        self.crashed = set()
+
+    def update(self, chat_id: int, text: str):
+        from telegram import Update
+        n = next(self._ids)
+        cmd = re.match(r"/\w+", text)
+        msg = {"message_id": n, "date": int(time.time()), "text": text,
+               "chat": {"id": chat_id, "type": "private"},
+               "from": {"id": OWNER_ID, "is_bot": False, "first_name": "bench"}}
+        if cmd:
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": cmd.end()}]
+        return Update.de_json({"update_id": n, "message": msg}, self.app.bot)
+
+    async def send(self, text: str, chat_id: int = OWNER_ID):
+        upd = self.update(chat_id, text)
+        await self.app.update_processor.process_update(upd, self.app.process_update(upd))
+
+    async def on_error(self, update, context):
+        if update is not None and update.effective_chat:
+            self.crashed.add(update.effective_chat.id)
+
+    def failed(self, chat_id: int) -> bool:
+        replies = self.tg.replies(chat_id)
+        return chat_id in self.crashed or not replies or any("⚠️" in r or "Ошибка" in r for r in replies)
+
+    async def run(self, texts: List[str], concurrency: int) -> dict:
+        sem = asyncio.Semaphore(concurrency)
+        chats = itertools.count(10_000_000 + next(self._ids) * 100_000)
+        lat, errors = [], 0
+
+        async def one(text):
+            nonlocal errors
+            chat_id = next(chats)  # one chat per request to attribute replies
+            async with sem:
+                t0 = time.perf_counter()
+                await self.send(text, chat_id)
+                lat.append(time.perf_counter() - t0)
+            errors += self.failed(chat_id)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(t) for t in texts))
+        wall = time.perf_counter() - t0
+        lat.sort()
+        return {"requests": len(texts), "errors": errors, "concurrency": concurrency, "wall_s": round(wall, 3),
+                "throughput_rps": round(len(texts) / wall, 2) if wall else None,
+                "mean_ms": _ms(sum(lat) / len(lat)) if lat else None,
+                **{f"p{int(q * 100)}_ms": _ms(_pct(lat, q)) for q in (0.5, 0.9, 0.95, 0.99)},
+                "max_ms": _ms(lat[-1]) if lat else None}
+
+# ===== Reporting =====
+def _label() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+def _table(results: Dict[str, dict]) -> str:
+    head = f"{'scenario':<14}{'req':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    rows = [head, "-" * len(head)]
+    for name, r in results.items():
+        cell = lambda v: f"{v:>9.1f}" if v is not None else f"{'—':>9}"
+        rows.append(f"{name:<14}{r['requests']:>6}{r['errors']:>5}{cell(r['throughput_rps'])}"
+                    f"{cell(r['p50_ms'])}{cell(r['p95_ms'])}{cell(r['p99_ms'])}{cell(r['max_ms'])}")
+    return "\n".join(rows)
+
+def compare(old: dict, new: dict, max_regression: float) -> List[str]:
+    """Per-scenario p50/p95/throughput deltas; returns the scenarios that regressed past the limit."""
+    worse = []
+    print(f"\ncompare {old.get('label') or '?'} -> {new.get('label') or '?'}")
+    skip = ("label", "scenarios", "compare", "max_regression", "log_level")
+    changed = [k for k, v in new["config"].items() if k not in skip and old.get("config", {}).get(k) != v]
+    if changed:
+        print("  warning: different settings, numbers are not comparable: " + ", ".join(changed))
+    for name, r in new["scenarios"].items():
+        base = old.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        parts = []
+        for key, higher_is_worse in (("p50_ms", True), ("p95_ms", True), ("throughput_rps", False)):
+            a, b = base.get(key), r.get(key)
+            if not a or b is None:
+                continue
+            delta = (b - a) / a
+            parts.append(f"{key} {a:.1f} -> {b:.1f} ({delta:+.0%})")
+            if (delta if higher_is_worse else -delta) > max_regression:
+                worse.append(f"{name}.{key}")
+        print(f"  {name}: " + "; ".join(parts))
+    return worse
+
+async def bench(args) -> dict:
+    services = start_services(args)
+    configure_env(services, args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as bot
+    from modules import metrics, startup
+
+    logging.getLogger().setLevel(args.log_level.upper())
+    app = bot.build_app()
+    driver = Driver(app, services["telegram"].fake)
+    app.add_error_handler(driver.on_error)
+    results, breakdown = {}, {}
+    async with app:
+        await driver.send(f"/login {bot.SECRET_LOGIN}")
+        await driver.send(f"/pass {bot.SECRET_PASSWORD}")
+        for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+            texts = workload(name, args.warmup + args.requests, args)
+            await driver.run(texts[:args.warmup], args.concurrency)
+            metrics.reset()
+            results[name] = await driver.run(texts[args.warmup:], args.concurrency)
+            # Inner timings (outbound calls, Aer runs) from the bot's own instrumentation
+            breakdown[name] = {op: {k: _ms(v) if k.startswith("p") else v for k, v in m.items()}
+                               for op, m in metrics.snapshot().items()}
+            print(f"{name}: {results[name]['throughput_rps']} rps, p95 {results[name]['p95_ms']} ms, errors {results[name]['errors']}", flush=True)
+        await bot.close_clients()
+    bot.shutdown_executors()
+    for s in services.values():
+        s.stop()
+    return {"label": args.label or _label(), "timestamp": int(time.time()),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+            "startup_ms": {k: round(v * 1000, 1) for k, v in startup.timings.items()},
+            "services": {n: {"requests": s.requests, "failures": s.failures} for n, s in services.items()},
+            "scenarios": results, "breakdown": breakdown}
+
+def bench_aer(args):
+    """Micro-benchmark of the Aer profiles; the fastest settings of each go to --aer-out."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from modules import quantum
+
+    names = list(quantum.AER_PROFILES) if args.aer == "all" else [n.strip() for n in args.aer.split(",") if n.strip()]
+    best = {}
+    for name in names:
+        r = quantum.aer_microbench(name, qubits=args.aer_qubits or None, repeats=args.aer_repeats)
+        best[name] = r["best"]
+        print(f"{name} ({r['circuit']}):")
+        for run in r["runs"]:
+            opts = ", ".join(f"{k}={v}" for k, v in run["options"].items())
+            print(f"  {run['seconds'] * 1000:>9.1f} ms  {opts}")
+    if args.aer_out:
+        with open(args.aer_out, "w", encoding="utf-8") as f:
+            json.dump(best, f, indent=2)
+        print(f"\nprofiles: {args.aer_out} (QUANTUM_AER_PROFILES_FILE)")
+
+def main():
+    p = argparse.ArgumentParser(description="Offline benchmark: fake Telegram + local API stand-ins + local Aer")
+    p.add_argument("--scenarios", default=SCENARIOS, help=f"comma-separated, default {SCENARIOS}")
+    p.add_argument("--requests", type=int, default=50, help="measured requests per scenario")
+    p.add_argument("--warmup", type=int, default=3, help="unmeasured requests per scenario (imports, pools)")
+    p.add_argument("--concurrency", type=int, default=8, help="updates in flight")
+    p.add_argument("--latency", type=float, default=0.05, help="stand-in API latency, s")
+    p.add_argument("--tg-latency", type=float, default=0.01, help="fake Telegram latency, s")
+    p.add_argument("--jitter", type=float, default=0.01, help="± uniform latency jitter, s")
+    p.add_argument("--fail", type=float, default=0.0, help="share of API requests answered with HTTP 500")
+    p.add_argument("--set", action="append", default=[], metavar="SERVICE.KEY=VALUE",
+                   help="per-service override, e.g. openai.fail=0.3 or wiki.latency=1 (repeatable)")
+    p.add_argument("--tokens", type=int, default=40, help="LLM answer length, tokens")
+    p.add_argument("--token-interval", type=float, default=0.005, help="LLM streaming pace, s per token")
+    p.add_argument("--qubits", default="3,5,8", help="qubit counts for quantum scenarios")
+    p.add_argument("--hot", type=float, default=0.0, help="share of repeated queries (exercise caches)")
+    p.add_argument("--seed", default="0")
+    p.add_argument("--label", default="", help="version label stored in the results (default: git describe)")
+    p.add_argument("--out", default="", help="write JSON results here")
+    p.add_argument("--compare", default="", help="previous JSON results to compare against")
+    p.add_argument("--max-regression", type=float, default=0.2, help="exit 1 if p50/p95/rps regress by more than this share")
+    p.add_argument("--log-level", default="warning")
+    p.add_argument("--aer", default="", help="only micro-benchmark these Aer profiles (comma-separated or 'all')")
+    p.add_argument("--aer-qubits", type=int, default=0, help="circuit width for --aer (default: per profile)")
+    p.add_argument("--aer-repeats", type=int, default=3, help="timed runs per candidate, best one counts")
+    p.add_argument("--aer-out", default="", help="write the fastest settings here (JSON for QUANTUM_AER_PROFILES_FILE)")
+    args = p.parse_args()
+    if args.aer:
+        bench_aer(args)
+        return
+
+    result = asyncio.run(bench(args))
+    print()
+    print(_table(result["scenarios"]))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nresults: {args.out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            worse = compare(json.load(f), result, args.max_regression)
+        if worse:
+            print("regressions: " + ", ".join(worse))
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
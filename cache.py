@@ -0,0 +1,155 @@
+import math, time, zlib, asyncio, sqlite3, threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+class TTLCache:
+    """Size-bounded LRU with per-entry TTL; optional SQLite file so entries survive restarts."""
+
+    def __init__(self, maxsize: int = 512, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL, atime REAL)")
+            self._db.commit()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item and item[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, item[1]
+            if item:
+                del self._data[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+                if row and row[1] > now:
+                    self._db.execute("UPDATE cache SET atime = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._put(key, row[0], row[1])
+                    self.hits += 1
+                    return True, row[0]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: str, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._put(key, value, now + ttl)
+            if self._db is not None and isinstance(value, str):
+                self._db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, value, now + ttl, now))
+                self._db.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+                self._db.execute("DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY atime DESC LIMIT ?)", (self.maxsize,))
+                self._db.commit()
+
+    # From coroutines: with a disk tier the SQLite I/O runs in a worker thread instead of the event loop
+    async def aget(self, key: str) -> Tuple[bool, Any]:
+        if self._db is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Any, ttl: float):
+        if self._db is None:
+            self.set(key, value, ttl)
+        else:
+            await asyncio.to_thread(self.set, key, value, ttl)
+
+    def _put(self, key: str, value: Any, expires: float):
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = f"{100 * self.hits / total:.0f}%" if total else "—"
+        return f"hit {self.hits} / miss {self.misses} ({rate}), записей {len(self._data)}"
+
+def hash_embedding(text: str, dim: int = 256) -> List[float]:
+    """Offline stand-in embedding: hashed character trigrams, L2-normalized."""
+    text = f"  {' '.join(text.split()).casefold()}  "
+    vec = [0.0] * dim
+    for i in range(len(text) - 2):
+        vec[zlib.crc32(text[i:i + 3].encode()) % dim] += 1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+class SemanticCache:
+    """Brute-force cosine nearest neighbour over cached prompts; TTL per entry, LRU beyond maxsize."""
+
+    def __init__(self, embed: Callable[[str], Awaitable[List[float]]], threshold: float = 0.9, maxsize: int = 256):
+        self.embed = embed
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, List[float], Any]]" = OrderedDict()
+        self._matrix = None  # (keys, vectors) snapshot, rebuilt after changes
+
+    def _nearest(self, vec: List[float]) -> Tuple[Optional[str], float]:
+        try:
+            import numpy as np
+        except Exception:
+            np = None
+        if not self._data:
+            return None, 0.0
+        if self._matrix is None:
+            keys = list(self._data)
+            vecs = [self._data[k][1] for k in keys]
+            self._matrix = (keys, np.array(vecs) if np is not None else vecs)
+        keys, mat = self._matrix
+        if np is not None:
+            scores = mat @ np.array(vec)
+            i = int(scores.argmax())
+            return keys[i], float(scores[i])
+        scores = [sum(a * b for a, b in zip(row, vec)) for row in mat]
+        i = max(range(len(scores)), key=scores.__getitem__)
+        return keys[i], scores[i]
+
+    async def get(self, text: str) -> Tuple[bool, Any]:
+        vec = await self.embed(text)
+        key, score = self._nearest(vec)
+        if key is not None and score >= self.threshold:
+            expires, _, value = self._data[key]
+            if expires > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self._data[key]
+            self._matrix = None
+        self.misses += 1
+        return False, None
+
+    async def set(self, text: str, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        vec = await self.embed(text)
+        self._data[text] = (time.time() + ttl, vec, value)
+        self._data.move_to_end(text)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        self._matrix = None
+
+    def clear(self):
+        self._data.clear()
+        self._matrix = None
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = f"{100 * self.hits / total:.0f}%" if total else "—"
+        return f"hit {self.hits} / miss {self.misses} ({rate}), записей {len(self._data)}"
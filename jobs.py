@@ -0,0 +1,179 @@
+import os, json, time, uuid, asyncio, logging
+from typing import Dict, Optional, Callable, Awaitable
+
+from modules.quantum import (build_preset, parse_qasm, run_local, submit_remote, remote_status,
+                             remote_result, cancel_remote, QUANTUM_WORKERS)
+
+QUANTUM_JOBS_FILE = os.getenv("QUANTUM_JOBS_FILE", "quantum_jobs.json")
+QUANTUM_JOB_CONCURRENCY = int(os.getenv("QUANTUM_JOB_CONCURRENCY", str(QUANTUM_WORKERS)))
+QUANTUM_POLL_INTERVAL = float(os.getenv("QUANTUM_POLL_INTERVAL", "15"))
+QUANTUM_JOBS_KEEP = int(os.getenv("QUANTUM_JOBS_KEEP", "50"))
+
+log = logging.getLogger(__name__)
+
+# status: queued -> running (local Aer) | remote (IBM or AWS Braket) -> done | error | cancelled
+_jobs: Dict[str, dict] = {}
+_tasks: Dict[str, asyncio.Task] = {}
+_sem: Optional[asyncio.Semaphore] = None
+_notify: Optional[Callable[[int, str], Awaitable]] = None
+_FINAL = ("done", "error", "cancelled")
+_ICONS = {"queued": "⏳", "running": "⚙️", "remote": "📡", "done": "✅", "error": "❌", "cancelled": "🚫"}
+
+def _save():
+    tmp = QUANTUM_JOBS_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(list(_jobs.values()), f, ensure_ascii=False)
+    os.replace(tmp, QUANTUM_JOBS_FILE)
+
+def _load():
+    if not os.path.exists(QUANTUM_JOBS_FILE):
+        return
+    try:
+        with open(QUANTUM_JOBS_FILE, encoding="utf-8") as f:
+            for job in json.load(f):
+                _jobs[job["id"]] = job
+    except Exception:
+        log.exception("cannot load %s", QUANTUM_JOBS_FILE)
+
+def _circuit(spec: dict):
+    if "qasm" in spec:
+        return parse_qasm(spec["qasm"])
+    return build_preset(spec["preset"], spec["qubits"])
+
+def _label(spec: dict) -> str:
+    label = f"preset {spec['preset']} {spec['qubits']}" if "preset" in spec else "openqasm"
+    return label + (" exact" if spec.get("exact") else "") + (f" {spec['profile']}" if spec.get("profile") else "")
+
+def _trim():
+    done = sorted((j for j in _jobs.values() if j["status"] in _FINAL), key=lambda j: j["created"])
+    for job in done[:max(0, len(done) - QUANTUM_JOBS_KEEP)]:
+        del _jobs[job["id"]]
+
+async def _finish(job: dict, status: str, result: str):
+    job.update(status=status, result=result, finished=time.time())
+    _trim()
+    _save()
+    if _notify:
+        try:
+            await _notify(job["chat_id"], f"{_ICONS[status]} Задача {job['id']} ({job['label']}): {status}. Результат: /quantum result {job['id']}")
+        except Exception:
+            log.exception("job notification failed")
+
+async def _track_remote(job: dict):
+    failures = 0
+    while True:
+        try:
+            st = await remote_status(job["remote_id"])
+            failures = 0
+        except Exception:
+            # Tolerate transient IBM/AWS/network errors while polling
+            failures += 1
+            if failures >= 5:
+                raise
+            await asyncio.sleep(QUANTUM_POLL_INTERVAL)
+            continue
+        if st == "DONE":
+            await _finish(job, "done", await remote_result(job["remote_id"], job["backend"]))
+            return
+        if st in ("ERROR", "CANCELLED"):
+            await _finish(job, "error" if st == "ERROR" else "cancelled", f"{job['backend']} job {job['remote_id']}: {st}")
+            return
+        await asyncio.sleep(QUANTUM_POLL_INTERVAL)
+
+async def _run(job: dict, qc=None):
+    try:
+        if job.get("remote_id"):
+            await _track_remote(job)
+            return
+        qc = qc if qc is not None else await asyncio.to_thread(_circuit, job["spec"])
+        exact = job["spec"].get("exact", False)
+        profile = job["spec"].get("profile")
+        remote = None if exact or profile else await submit_remote(qc)
+        if remote:
+            job.update(status="remote", backend=remote[0], remote_id=remote[1])
+            _save()
+            await _track_remote(job)
+            return
+        async with _sem:
+            job.update(status="running", backend="aer")
+            _save()
+            text = await run_local(qc, exact=True if exact else None, profile=profile)
+        await _finish(job, "done", text)
+    except asyncio.CancelledError:
+        # Only an explicit /quantum cancel is final; shutdown leaves the job to be resumed
+        if job["status"] == "cancelled":
+            _save()
+        raise
+    except Exception as e:
+        log.exception("job %s failed", job["id"])
+        await _finish(job, "error", f"Ошибка: {type(e).__name__}: {e}")
+    finally:
+        _tasks.pop(job["id"], None)
+
+def _spawn(job: dict, qc=None):
+    _tasks[job["id"]] = asyncio.create_task(_run(job, qc))
+
+async def start_jobs(notify: Optional[Callable[[int, str], Awaitable]] = None):
+    global _sem, _notify
+    _sem = asyncio.Semaphore(QUANTUM_JOB_CONCURRENCY)
+    _notify = notify
+    _load()
+    for job in list(_jobs.values()):
+        if job["status"] not in _FINAL:
+            _spawn(job)
+
+async def stop_jobs():
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def submit_job(chat_id: int, spec: dict) -> str:
+    try:
+        qc = await asyncio.to_thread(_circuit, spec)
+    except Exception as e:
+        return f"Ошибка парсинга OpenQASM 3.0: {e}"
+    if qc is None:
+        return "Неизвестный пресет. Доступно: bell, ghz, qft."
+    job = {"id": uuid.uuid4().hex[:8], "chat_id": chat_id, "spec": spec, "label": _label(spec),
+           "status": "queued", "created": time.time(), "finished": None,
+           "backend": None, "remote_id": None, "result": None}
+    _jobs[job["id"]] = job
+    _save()
+    _spawn(job, qc)
+    return f"📥 Задача {job['id']} принята ({job['label']}). Статус: /quantum jobs"
+
+def list_jobs() -> str:
+    if not _jobs:
+        return "Задач нет."
+    lines = ["🗂️ Задачи:"]
+    for job in sorted(_jobs.values(), key=lambda j: j["created"], reverse=True)[:20]:
+        backend = f" [{job['backend']}]" if job.get("backend") else ""
+        lines.append(f"{_ICONS[job['status']]} {job['id']} — {job['label']}{backend}: {job['status']}")
+    return "\n".join(lines)
+
+def job_result(job_id: str) -> str:
+    job = _jobs.get(job_id)
+    if not job:
+        return "Задача не найдена."
+    if job["status"] not in _FINAL:
+        return f"{_ICONS[job['status']]} Задача {job_id} ещё выполняется ({job['status']})."
+    return job["result"] or f"Задача {job_id}: {job['status']}."
+
+async def cancel_job(job_id: str) -> str:
+    job = _jobs.get(job_id)
+    if not job:
+        return "Задача не найдена."
+    if job["status"] in _FINAL:
+        return f"Задача {job_id} уже завершена ({job['status']})."
+    if job.get("remote_id"):
+        try:
+            await cancel_remote(job["remote_id"])
+        except Exception:
+            log.exception("remote cancel failed for %s", job_id)
+    job.update(status="cancelled", finished=time.time())
+    task = _tasks.get(job_id)
+    if task:
+        task.cancel()
+    _save()
+    return f"🚫 Задача {job_id} отменена."
@@ -0,0 +1,103 @@
+import os, time, asyncio
+from typing import Awaitable, Callable, Dict
+
+from modules.metrics import gauge, inc, observe
+
+class TokenBucket:
+    """Async token bucket: `rate` requests/s with bursts up to `burst`; callers queue in FIFO order instead of failing."""
+
+    def __init__(self, name: str, rate: float, burst: int = 1):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self.waited = 0.0  # total seconds spent queued
+        self._lock = asyncio.Lock()  # FIFO: waiters are served in arrival order
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        self.waiting += 1
+        gauge("queue_depth", self.name, self.waiting)
+        t0 = time.monotonic()
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            wait = time.monotonic() - t0
+            self.waiting -= 1
+            self.waited += wait
+            gauge("queue_depth", self.name, self.waiting)
+            observe(f"limit.{self.name}", wait)
+
+    def stats(self) -> str:
+        if self.rate <= 0:
+            return f"{self.name}: без лимита"
+        return f"{self.name}: {self.rate:g}/s, burst {self.burst}, очередь {self.waiting}, ожидание {self.waited:.1f}s"
+
+_buckets: Dict[str, TokenBucket] = {}
+
+def limiter(name: str, rate: float, burst: int = 1) -> TokenBucket:
+    # Defaults are overridden by <NAME>_RPS and <NAME>_BURST; 0 turns the limit off
+    if name not in _buckets:
+        key = name.upper()
+        _buckets[name] = TokenBucket(name, float(os.getenv(f"{key}_RPS", str(rate))),
+                                     int(os.getenv(f"{key}_BURST", str(burst))))
+    return _buckets[name]
+
+def limits_stats() -> str:
+    return "🚦 Лимиты: " + ("; ".join(b.stats() for b in _buckets.values()) or "—")
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight task instead of repeating the work.
+
+    The task is cancelled once every caller waiting for it has been cancelled (e.g. a hedged loser).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.shared = 0
+        self._calls: Dict[str, list] = {}  # key -> [task, waiters]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        entry = self._calls.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(fn())
+            entry = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+            inc("coalesced", self.name)
+        task = entry[0]
+        entry[1] += 1
+        try:
+            # shield: one caller giving up must not cancel the work the others wait for
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry[1] == 1 and not task.done():
+                # Last waiter gone: stop the work; later callers start afresh
+                if self._calls.get(key) is entry:
+                    del self._calls[key]
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    def _done(self, key: str, task: asyncio.Task):
+        entry = self._calls.get(key)
+        if entry is not None and entry[0] is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an abandoned failure is not reported as unhandled
+
+    def in_flight(self) -> int:
+        return len(self._calls)
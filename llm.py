@@ -1,15 +1,179 @@
-import os
-from typing import List, Dict
-from openai import AsyncOpenAI
-import anthropic
+import os, re, time, asyncio, logging
+from collections import deque
+from typing import List, Dict, AsyncIterator, Optional, Tuple
+
+from modules.cache import TTLCache, SemanticCache, hash_embedding
+from modules.startup import timed
+from modules.metrics import track, observe, inc
+from modules.limits import limiter, SingleFlight
 
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-20240620")
+LLM_CHAT_TOKEN_BUDGET = int(os.getenv("LLM_CHAT_TOKEN_BUDGET", "3000"))
+LLM_SUMMARY_TOKENS = int(os.getenv("LLM_SUMMARY_TOKENS", "300"))
+LLM_PROMPT_CACHE = os.getenv("LLM_PROMPT_CACHE", "1") == "1"
+CHAT_SYSTEM = "Ты диалоговый ассистент. Отвечай по делу."
+ASK_TEMPERATURE = 0.3
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+LLM_SEMANTIC_CACHE = os.getenv("LLM_SEMANTIC_CACHE", "0") == "1"
+LLM_SEMANTIC_THRESHOLD = float(os.getenv("LLM_SEMANTIC_THRESHOLD", "0.9"))
+LLM_EMBEDDER = os.getenv("LLM_EMBEDDER", "local").lower()  # local | openai
+NOT_CONFIGURED = "LLM не настроен: проверь ключи и LLM_PROVIDER."
+
+log = logging.getLogger(__name__)
 
 _openai_client = None
 _anth_client = None
-_chat_history: List[Dict[str, str]] = []
+
+# Optional exact tokenizer (loaded on first use); otherwise ~3 chars per token (Cyrillic-heavy text)
+_enc = None
+
+def _encoder():
+    global _enc
+    if _enc is None:
+        try:
+            with timed("tiktoken"):
+                import tiktoken
+            try:
+                _enc = tiktoken.encoding_for_model(OPENAI_MODEL)
+            except Exception:
+                _enc = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _enc = False
+    return _enc
+
+def _count_tokens(text: str) -> int:
+    enc = _encoder()
+    if enc:
+        return len(enc.encode(text)) + 4
+    return len(text) // 3 + 4
+
+class ChatMemory:
+    """Chat window trimmed to a token budget; evicted turns are folded into a rolling summary."""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.messages: List[Dict] = []  # {"role", "content", "tokens"}; tokens counted once
+        self.summary = ""
+        self._evicted: List[Dict] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, role: str, content: str):
+        self.messages.append({"role": role, "content": content, "tokens": _count_tokens(content)})
+        self._trim()
+
+    def _trim(self):
+        total = sum(m["tokens"] for m in self.messages)
+        # Keep the newest message even if it alone exceeds the budget; the window must start with a user turn
+        while len(self.messages) > 1 and (total > self.budget or self.messages[0]["role"] != "user"):
+            m = self.messages.pop(0)
+            total -= m["tokens"]
+            self._evicted.append(m)
+        if self._evicted and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._summarize())
+
+    async def _summarize(self):
+        while self._evicted:
+            batch, self._evicted = self._evicted, []
+            dialog = "\n".join(f"{m['role']}: {m['content']}" for m in batch)
+            prompt = (f"Текущее резюме диалога:\n{self.summary or '(пусто)'}\n\n"
+                      f"Новые реплики:\n{dialog}\n\n"
+                      "Обнови резюме: сохрани факты, договорённости и открытые вопросы, не длиннее нескольких абзацев.")
+            try:
+                text = await _complete("Ты сжимаешь историю диалога в краткое резюме.", prompt, LLM_SUMMARY_TOKENS, 0.2)
+            except Exception:
+                log.exception("chat summary failed")
+                return
+            if text:
+                self.summary = text.strip()
+
+    def window(self) -> List[Dict[str, str]]:
+        return [{"role": m["role"], "content": m["content"]} for m in self.messages]
+
+    def system(self) -> str:
+        if not self.summary:
+            return CHAT_SYSTEM
+        return f"{CHAT_SYSTEM}\n\nКраткое содержание предыдущей части диалога:\n{self.summary}"
+
+    def clear(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self.messages.clear()
+        self._evicted.clear()
+        self.summary = ""
+
+_memory = ChatMemory(LLM_CHAT_TOKEN_BUDGET)
+
+# ===== /ask response cache: exact key, optionally nearest-neighbour over prompt embeddings =====
+async def _local_embed(text: str) -> List[float]:
+    return hash_embedding(text)
+
+async def _openai_embed(text: str) -> List[float]:
+    await _ensure_clients()
+    if not _openai_client:
+        return hash_embedding(text)
+    await _limit("openai")
+    resp = await _openai_client.embeddings.create(model=os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small"), input=text)
+    return resp.data[0].embedding
+
+_embed = _openai_embed if LLM_EMBEDDER == "openai" else _local_embed
+_ask_cache = TTLCache(LLM_CACHE_SIZE, os.getenv("LLM_CACHE_DB") or None)
+_semantic: Dict[str, SemanticCache] = {}
+_embeddings = TTLCache(LLM_CACHE_SIZE)  # prompt -> vector, shared by every scope's lookup and store
+
+async def _embed_once(text: str) -> List[float]:
+    # One (possibly paid) embedding call per prompt, however many provider scopes are searched
+    found, vec = _embeddings.get(text)
+    if not found:
+        vec = await _embed(text)
+        _embeddings.set(text, vec, 3600)
+    return vec
+
+def set_embedder(fn):
+    global _embed
+    _embed = fn
+    _embeddings.clear()
+    _semantic.clear()
+
+def _norm_prompt(prompt: str) -> str:
+    return re.sub(r"[\s?!.]+$", "", " ".join(prompt.split()).casefold())
+
+def _semantic_for(scope: str) -> SemanticCache:
+    if scope not in _semantic:
+        _semantic[scope] = SemanticCache(_embed_once, LLM_SEMANTIC_THRESHOLD, LLM_CACHE_SIZE)
+    return _semantic[scope]
+
+def _ask_scope(provider: str) -> str:
+    model = ANTHROPIC_MODEL if provider == "anthropic" else OPENAI_MODEL
+    return f"{provider}:{model}:{ASK_TEMPERATURE}"
+
+async def _ask_cached(prompt: str) -> Optional[str]:
+    # Answers are stored under the provider that gave them; any provider the router would use now may serve
+    await _ensure_clients()
+    scopes, norm = [_ask_scope(name) for name in _order()], _norm_prompt(prompt)
+    for scope in scopes:
+        found, text = await _ask_cache.aget(f"{scope}:{norm}")
+        if found:
+            inc("cache_hit", "llm.ask")
+            return text
+    if LLM_SEMANTIC_CACHE:
+        for scope in scopes:
+            found, text = await _semantic_for(scope).get(norm)
+            if found:
+                inc("cache_hit", "llm.ask.semantic")
+                return text
+    inc("cache_miss", "llm.ask")
+    return None
+
+async def _ask_store(prompt: str, text: str, provider: Optional[str]):
+    if not text or text == NOT_CONFIGURED or not provider:
+        return
+    scope, norm = _ask_scope(provider), _norm_prompt(prompt)
+    await _ask_cache.aset(f"{scope}:{norm}", text, LLM_CACHE_TTL)
+    if LLM_SEMANTIC_CACHE:
+        await _semantic_for(scope).set(norm, text, LLM_CACHE_TTL)
 
 def llm_status() -> str:
     has_oai = bool(os.getenv("OPENAI_API_KEY"))
@@ -18,56 +182,375 @@ def llm_status() -> str:
     return ("🤖 LLM:\n"
             f"• provider: {prov}\n"
             f"• openai: {'✅' if has_oai else '❌'} (model: {OPENAI_MODEL})\n"
-            f"• anthropic: {'✅' if has_an else '❌'} (model: {ANTHROPIC_MODEL})")
+            f"• anthropic: {'✅' if has_an else '❌'} (model: {ANTHROPIC_MODEL})\n"
+            f"• кэш /ask: {_ask_cache.stats()}" + (f"; похожие: {sum(c.hits for c in _semantic.values())} hit" if LLM_SEMANTIC_CACHE else "") + "\n"
+            f"• chat: {len(_memory.messages)} сообщ., ~{sum(m['tokens'] for m in _memory.messages)}/{_memory.budget} токенов, резюме: {'да' if _memory.summary else 'нет'}\n"
+            f"• роутинг: {LLM_ROUTING}, порядок: {', '.join(LLM_PROVIDERS)}, hedge: {'on' if LLM_HEDGE else 'off'}"
+            + "".join(_provider_line(name) for name in LLM_PROVIDERS))
 
-async def _ensure_clients():
+def _fmt_s(v: Optional[float]) -> str:
+    return f"{v:.2f}s" if v is not None else "—"
+
+def _provider_line(name: str) -> str:
+    st = _stats[name]
+    state = "🟢" if st.healthy() else f"🔴 пауза {st.open_until - time.monotonic():.0f}s"
+    return (f"\n  · {name}: {state}, p50 {_fmt_s(st.p(0.5))}, p95 {_fmt_s(st.p(0.95))}, "
+            f"ttfb p50 {_fmt_s(st.p(0.5, True))}, ошибки {100 * st.error_rate():.0f}% ({len(st.results)})")
+
+def load_sdk():
+    # SDKs are imported on first LLM use (or by prewarm), only for configured providers
+    if os.getenv("OPENAI_API_KEY"):
+        with timed("openai"):
+            import openai  # noqa: F401
+    if os.getenv("ANTHROPIC_API_KEY"):
+        with timed("anthropic"):
+            import anthropic  # noqa: F401
+    _encoder()
+
+def _make_clients():
     global _openai_client, _anth_client
     if _openai_client is None and os.getenv("OPENAI_API_KEY"):
-        _openai_client = AsyncOpenAI()
+        with timed("openai"):
+            from openai import AsyncOpenAI
+            _openai_client = AsyncOpenAI()
     if _anth_client is None and os.getenv("ANTHROPIC_API_KEY"):
-        _anth_client = anthropic.AsyncAnthropic()
+        with timed("anthropic"):
+            import anthropic
+            _anth_client = anthropic.AsyncAnthropic()
+
+async def _ensure_clients():
+    # First use imports the SDKs (hundreds of ms): in a thread, so other chats keep being served
+    if (_openai_client is None and os.getenv("OPENAI_API_KEY")) or (_anth_client is None and os.getenv("ANTHROPIC_API_KEY")):
+        await asyncio.to_thread(_make_clients)
+
+async def _ensure_encoder():
+    # tiktoken may download its BPE files on first use
+    if _enc is None:
+        await asyncio.to_thread(_encoder)
+
+# ===== Provider calls: one neutral request shape (system, messages, max_tokens, temperature) =====
+ASK_SYSTEM = "Ты краткий, точный помощник."
+
+def _anth_messages(cached: bool = False):
+    # Prompt caching is a beta endpoint in this SDK version
+    return _anth_client.beta.prompt_caching.messages if cached else _anth_client.messages
+
+# Stable prefix first (system + summary): OpenAI caches long prefixes automatically,
+# Anthropic needs explicit cache_control breakpoints
+def _anthropic_kwargs(system, messages, max_tokens, temperature, cache_prefix=False) -> dict:
+    kw = dict(model=ANTHROPIC_MODEL, max_tokens=max_tokens, temperature=temperature, messages=messages)
+    if system:
+        kw["system"] = [{"type":"text","text":system,"cache_control":{"type":"ephemeral"}}] if cache_prefix else system
+    if cache_prefix and messages:
+        kw["messages"] = _mark_history(messages)
+    return kw
+
+def _breakpoint(msg: dict) -> dict:
+    content = msg["content"] if isinstance(msg["content"], list) else [{"type":"text","text":msg["content"]}]
+    return {**msg, "content": [*content[:-1], {**content[-1], "cache_control":{"type":"ephemeral"}}]}
+
+def _mark_history(messages: list) -> list:
+    # System + summary alone stay under Anthropic's 1024-token minimum, so the history gets breakpoints too:
+    # the last stable turn, and the new message so the next turn reads this whole prompt from the cache
+    marked = [*messages[:-2], _breakpoint(messages[-2])] if len(messages) > 1 else []
+    return marked + [_breakpoint(messages[-1])]
+
+def _cache_usage(usage):
+    read = getattr(usage, "cache_read_input_tokens", None) or 0
+    inc("prompt_cache_read" if read else "prompt_cache_miss", "llm.anthropic")
+    log.debug("anthropic prompt cache: read %s, written %s", read, getattr(usage, "cache_creation_input_tokens", None))
 
-async def ask_once(prompt: str) -> str:
+def _openai_kwargs(system, messages, max_tokens, temperature, cache_prefix=False) -> dict:
+    msgs = ([{"role":"system","content":system}] if system else []) + messages
+    return dict(model=OPENAI_MODEL, messages=msgs, temperature=temperature, max_tokens=max_tokens)
+
+async def _anthropic_call(cache_prefix=False, **req) -> str:
+    resp = await _anth_messages(cache_prefix).create(**_anthropic_kwargs(cache_prefix=cache_prefix, **req))
+    if cache_prefix:
+        _cache_usage(resp.usage)
+    return "".join(getattr(block, "text", "") for block in resp.content)
+
+async def _openai_call(cache_prefix=False, **req) -> str:
+    resp = await _openai_client.chat.completions.create(**_openai_kwargs(**req))
+    return resp.choices[0].message.content.strip()
+
+# ===== Streaming: async generators of text deltas =====
+async def _anthropic_stream(cache_prefix=False, **req) -> AsyncIterator[str]:
+    async with _anth_messages(cache_prefix).stream(**_anthropic_kwargs(cache_prefix=cache_prefix, **req)) as stream:
+        async for text in stream.text_stream:
+            yield text
+        if cache_prefix:
+            _cache_usage((await stream.get_final_message()).usage)
+
+async def _openai_stream(cache_prefix=False, **req) -> AsyncIterator[str]:
+    stream = await _openai_client.chat.completions.create(stream=True, **_openai_kwargs(**req))
+    # Closing the response stops generation (and billing) when a hedged loser or the consumer gives up
+    async with stream:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+_CALLS = {"anthropic": _anthropic_call, "openai": _openai_call}
+_STREAMS = {"anthropic": _anthropic_stream, "openai": _openai_stream}
+
+# ===== Router: latency/error tracking, hedging and a circuit breaker per provider =====
+def _providers_conf() -> List[str]:
+    other = "anthropic" if LLM_PROVIDER == "openai" else "openai"
+    names = [p.strip().lower() for p in os.getenv("LLM_PROVIDERS", f"{LLM_PROVIDER},{other}").split(",")]
+    return [p for p in dict.fromkeys(names) if p in _CALLS]
+
+LLM_PROVIDERS = _providers_conf()
+LLM_ROUTING = os.getenv("LLM_ROUTING", "fixed").lower()  # fixed: LLM_PROVIDERS order | fastest: by p50 latency
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN = float(os.getenv("LLM_HEDGE_MIN", "1.0"))
+LLM_HEDGE_MAX = float(os.getenv("LLM_HEDGE_MAX", "10.0"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+
+class ProviderStats:
+    def __init__(self, window: int = 50):
+        self.latency = deque(maxlen=window)  # full call, seconds
+        self.ttfb = deque(maxlen=window)     # first streamed chunk, seconds
+        self.results = deque(maxlen=window)  # True = ok
+        self.failures = 0
+        self.open_until = 0.0
+
+    @staticmethod
+    def _q(values, q: float) -> Optional[float]:
+        if not values:
+            return None
+        data = sorted(values)
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+    def p(self, q: float, stream: bool = False) -> Optional[float]:
+        return self._q(self.ttfb if stream else self.latency, q)
+
+    def record(self, ok: bool, seconds: Optional[float] = None, stream: bool = False):
+        self.results.append(ok)
+        if ok:
+            self.failures = 0
+            if seconds is not None:
+                (self.ttfb if stream else self.latency).append(seconds)
+        else:
+            self.failures += 1
+            if self.failures >= LLM_BREAKER_FAILURES:
+                self.open_until = time.monotonic() + LLM_BREAKER_COOLDOWN
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def error_rate(self) -> float:
+        return 1 - sum(self.results) / len(self.results) if self.results else 0.0
+
+_stats: Dict[str, ProviderStats] = {name: ProviderStats() for name in _CALLS}
+
+def _available(name: str) -> bool:
+    return bool(_anth_client) if name == "anthropic" else bool(_openai_client)
+
+def _order(stream: bool = False) -> List[str]:
+    names = [n for n in LLM_PROVIDERS if _available(n)]
+    if LLM_ROUTING == "fastest":
+        # Providers without data sort first so they get measured
+        names.sort(key=lambda n: _stats[n].p(0.5, stream) or 0.0)
+    healthy = [n for n in names if _stats[n].healthy()]
+    # All breakers open: try anyway (half-open) rather than fail outright
+    return healthy or names
+
+def _hedge_delay(name: str, stream: bool = False) -> float:
+    p95 = _stats[name].p(0.95, stream)
+    return min(LLM_HEDGE_MAX, max(LLM_HEDGE_MIN, p95 if p95 is not None else LLM_HEDGE_MAX))
+
+# Requests/s and burst per provider; OPENAI_RPS / ANTHROPIC_RPS (and _BURST) override, 0 = off
+_RATES = {"openai": (5, 10), "anthropic": (0.8, 5)}
+
+async def _limit(name: str):
+    await limiter(name, *_RATES[name]).acquire()
+
+async def _timed_call(name: str, **req) -> str:
+    # Queueing for the rate limit is not counted as provider latency
+    await _limit(name)
+    t0 = time.monotonic()
+    try:
+        with track(f"llm.{name}") as t:
+            text = await _CALLS[name](**req)
+            t.size = len(text.encode())
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        _stats[name].record(False)
+        raise
+    _stats[name].record(True, time.monotonic() - t0)
+    return text
+
+# served: optional dict that receives {"provider": name} of the provider whose answer is returned
+async def _route(served: Optional[dict] = None, **req) -> str:
     await _ensure_clients()
-    if LLM_PROVIDER == "anthropic" and _anth_client:
-        resp = await _anth_client.messages.create(
-            model=ANTHROPIC_MODEL, max_tokens=800, temperature=0.3,
-            messages=[{"role":"user","content":prompt}]
-        )
-        return "".join(getattr(block, "text", "") for block in resp.content)
-    elif LLM_PROVIDER == "openai" and _openai_client:
-        resp = await _openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role":"system","content":"Ты краткий, точный помощник."},
-                      {"role":"user","content":prompt}],
-            temperature=0.3, max_tokens=800
-        )
-        return resp.choices[0].message.content.strip()
-    else:
-        return "LLM не настроен: проверь ключи и LLM_PROVIDER."
+    order = _order()
+    if not order:
+        return NOT_CONFIGURED
+    tasks: Dict[asyncio.Task, str] = {}
+    launched = 0
+    last_exc: Optional[BaseException] = None
 
-async def chat_reply(user_msg: str) -> str:
+    def launch():
+        nonlocal launched
+        name = order[launched]
+        launched += 1
+        tasks[asyncio.create_task(_timed_call(name, **req))] = name
+
+    launch()
+    try:
+        while tasks:
+            delay = _hedge_delay(order[0]) if LLM_HEDGE and launched < len(order) else None
+            done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()  # hedge: primary is slower than its p95
+                continue
+            for task in done:
+                name = tasks.pop(task)
+                if task.exception() is None:
+                    if served is not None:
+                        served["provider"] = name
+                    return task.result()
+                last_exc = task.exception()
+                log.warning("LLM provider failed: %s", type(last_exc).__name__)
+            if not tasks and launched < len(order):
+                launch()  # failover
+        raise last_exc
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def _limited_stream(name: str, **req) -> AsyncIterator[str]:
+    # Rate-limit wait happens before the first chunk, so it shows up in time-to-first-token
+    await _limit(name)
+    gen = _STREAMS[name](**req)
+    try:
+        async for text in gen:
+            yield text
+    finally:
+        await gen.aclose()
+
+async def _route_stream(served: Optional[dict] = None, **req) -> AsyncIterator[str]:
+    # Race on the first chunk; the loser's stream is closed, the winner is streamed through
     await _ensure_clients()
-    _chat_history.append({"role":"user","content":user_msg})
-    if len(_chat_history) > 24:
-        del _chat_history[:len(_chat_history)-24]
-
-    if LLM_PROVIDER == "anthropic" and _anth_client:
-        resp = await _anth_client.messages.create(
-            model=ANTHROPIC_MODEL, max_tokens=900, temperature=0.6,
-            messages=[{"role":m["role"], "content":m["content"]} for m in _chat_history]
-        )
-        text = "".join(getattr(block, "text", "") for block in resp.content)
-    elif LLM_PROVIDER == "openai" and _openai_client:
-        msgs = [{"role":"system","content":"Ты диалоговый ассистент. Отвечай по делу."}] + _chat_history
-        resp = await _openai_client.chat.completions.create(
-            model=OPENAI_MODEL, messages=msgs, temperature=0.6, max_tokens=900
-        )
-        text = resp.choices[0].message.content.strip()
-    else:
-        text = "LLM не настроен: проверь ключи и LLM_PROVIDER."
-    _chat_history.append({"role":"assistant","content":text})
+    order = _order(stream=True)
+    if not order:
+        yield NOT_CONFIGURED
+        return
+    gens: Dict[str, AsyncIterator[str]] = {}
+    tasks: Dict[asyncio.Future, Tuple[str, float]] = {}
+    launched = 0
+    last_exc: Optional[BaseException] = None
+    winner = None
+
+    def launch():
+        nonlocal launched
+        name = order[launched]
+        launched += 1
+        gens[name] = _limited_stream(name, **req)
+        tasks[asyncio.ensure_future(gens[name].__anext__())] = (name, time.monotonic())
+
+    launch()
+    try:
+        while tasks and winner is None:
+            delay = _hedge_delay(order[0], stream=True) if LLM_HEDGE and launched < len(order) else None
+            done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            for task in done:
+                name, t0 = tasks.pop(task)
+                exc = task.exception()
+                if exc is None or isinstance(exc, StopAsyncIteration):
+                    winner = (name, "" if exc else task.result(), t0)
+                    break
+                _stats[name].record(False, stream=True)
+                observe(f"llm.{name}.ttfb", time.monotonic() - t0, ok=False)
+                last_exc = exc
+                log.warning("LLM provider %s failed: %s", name, type(exc).__name__)
+            if winner is None and not tasks and launched < len(order):
+                launch()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for name, gen in gens.items():
+            if winner is None or name != winner[0]:
+                await gen.aclose()
+    if winner is None:
+        raise last_exc
+    name, first, t0 = winner
+    if served is not None:
+        served["provider"] = name
+    _stats[name].record(True, time.monotonic() - t0, stream=True)
+    observe(f"llm.{name}.ttfb", time.monotonic() - t0)
+    if first:
+        yield first
+    try:
+        async for text in gens[name]:
+            yield text
+    except Exception:
+        _stats[name].record(False, stream=True)
+        raise
+
+# ===== Public API =====
+def _ask_req(prompt: str) -> dict:
+    return dict(system=ASK_SYSTEM, messages=[{"role":"user","content":prompt}], max_tokens=800, temperature=ASK_TEMPERATURE)
+
+_ask_flight = SingleFlight("llm.ask")
+
+async def _ask_fresh(prompt: str) -> str:
+    served = {}
+    text = await _route(served=served, **_ask_req(prompt))
+    await _ask_store(prompt, text, served.get("provider"))
+    return text
+
+async def ask_once(prompt: str, fresh: bool = False) -> str:
+    if fresh:
+        return await _ask_fresh(prompt)
+    cached = await _ask_cached(prompt)
+    if cached is not None:
+        return cached
+    # The same question already in flight: wait for that answer (it lands in the cache too)
+    # Keyed by the request (configured providers and models), not by whoever ends up answering
+    key = ":".join(_ask_scope(name) for name in LLM_PROVIDERS) + f":{_norm_prompt(prompt)}"
+    return await _ask_flight.do(key, lambda: _ask_fresh(prompt))
+
+async def ask_stream(prompt: str, fresh: bool = False) -> AsyncIterator[str]:
+    if not fresh:
+        cached = await _ask_cached(prompt)
+        if cached is not None:
+            yield cached
+            return
+    parts, served = [], {}
+    async for text in _route_stream(served=served, **_ask_req(prompt)):
+        parts.append(text)
+        yield text
+    await _ask_store(prompt, "".join(parts).strip(), served.get("provider"))
+
+async def _complete(system: str, prompt: str, max_tokens: int, temperature: float) -> str:
+    text = await _route(system=system, messages=[{"role":"user","content":prompt}], max_tokens=max_tokens, temperature=temperature)
+    return "" if text == NOT_CONFIGURED else text
+
+def _chat_req() -> dict:
+    return dict(system=_memory.system(), messages=_memory.window(), max_tokens=900, temperature=0.6, cache_prefix=LLM_PROMPT_CACHE)
+
+async def chat_stream(user_msg: str) -> AsyncIterator[str]:
+    await _ensure_encoder()
+    _memory.add("user", user_msg)
+    parts = []
+    async for text in _route_stream(**_chat_req()):
+        parts.append(text)
+        yield text
+    _memory.add("assistant", "".join(parts).strip())
+
+async def chat_reply(user_msg: str) -> str:
+    await _ensure_encoder()
+    _memory.add("user", user_msg)
+    text = await _route(**_chat_req())
+    _memory.add("assistant", text)
     return text
 
 def reset_chat():
-    _chat_history.clear()
+    _memory.clear()
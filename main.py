@@ -1,14 +1,31 @@
-import os, time, logging, asyncio
+import os, re, io, csv, json, time, uuid, logging, asyncio
 from functools import wraps
-from typing import Callable, Awaitable
+from typing import Callable, Awaitable, Dict, List, Tuple
 
-from telegram import Update
-from telegram.constants import ParseMode
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
+from modules.startup import timed, report, prewarm, since_start
 
-from modules.web import web_search, google_search, bing_search, wiki_summary
-from modules.quantum import run_preset_circuit, run_openqasm, backends_info
-from modules.llm import ask_once, chat_reply, reset_chat, llm_status
+# Heavy SDKs (qiskit, openai, anthropic, braket) are imported lazily inside the modules
+with timed("telegram"):
+    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.constants import ParseMode
+    from telegram.error import BadRequest, RetryAfter
+    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+
+with timed("modules.cache"):
+    from modules.cache import TTLCache
+with timed("modules.web"):
+    from modules.web import web_search, google_search, bing_search, wiki_summary, close_clients, cache_stats
+with timed("modules.quantum"):
+    from modules.quantum import run_preset_circuit, run_openqasm, backends_info, shutdown_executors, sweep_preset, sweep_openqasm
+    from modules.quantum import load_sdk as load_quantum_sdk, AER_PROFILES
+with timed("modules.jobs"):
+    from modules.jobs import start_jobs, stop_jobs, submit_job, list_jobs, job_result, cancel_job
+with timed("modules.metrics"):
+    from modules.metrics import instrument, summary as metrics_summary, serve as serve_metrics
+    from modules.limits import limits_stats
+with timed("modules.llm"):
+    from modules.llm import ask_once, chat_reply, reset_chat, llm_status, ask_stream, chat_stream
+    from modules.llm import load_sdk as load_llm_sdk
 
 BOT_NAME = os.getenv("BOT_NAME", "LockedQuantumBot")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -18,6 +35,37 @@ SECRET_LOGIN = os.getenv("SECRET_LOGIN", "")
 SECRET_PASSWORD = os.getenv("SECRET_PASSWORD", "")
 LOGIN_TTL_HOURS = int(os.getenv("LOGIN_TTL_HOURS", "12"))
 
+LLM_STREAM = os.getenv("LLM_STREAM", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))
+TG_LIMIT = 4096
+PREWARM = os.getenv("PREWARM", "0") == "1"
+
+# Updates: polling (default) or webhook; TELEGRAM_BASE_URL points the bot at a local fake API in tests
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling").lower()
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+# Replies over TG_LIMIT: pages (inline ◀ ▶ buttons), chunks (several messages) or file (document)
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "pages").lower()
+OUTPUT_MAX_CHUNKS = int(os.getenv("OUTPUT_MAX_CHUNKS", "4"))  # more than this goes out as a document
+OUTPUT_FILE_FORMAT = os.getenv("OUTPUT_FILE_FORMAT", "csv").lower()  # csv | json | png (png needs matplotlib)
+OUTPUT_PAGES_TTL = float(os.getenv("OUTPUT_PAGES_TTL", "3600"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Per-group limits: state-mutating commands are serialized, read-only work runs in parallel
+CONCURRENCY = {
+    "auth": 1,
+    "chat": 1,
+    "web": int(os.getenv("WEB_CONCURRENCY", "8")),
+    "llm": int(os.getenv("LLM_CONCURRENCY", "4")),
+    "quantum": int(os.getenv("QUANTUM_CONCURRENCY", "4")),
+}
+
 if not BOT_TOKEN or OWNER_ID == 0 or not SECRET_LOGIN or not SECRET_PASSWORD:
     raise SystemExit("Missing required env: BOT_TOKEN, OWNER_ID, SECRET_LOGIN, SECRET_PASSWORD")
 
@@ -31,6 +79,19 @@ def redact(text: str) -> str:
             text = text.replace(v, f"[{key}_REDACTED]")
     return text
 
+_sems: Dict[str, asyncio.Semaphore] = {}
+
+def limited(group: str):
+    def deco(fn: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable]):
+        @wraps(fn)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            if group not in _sems:
+                _sems[group] = asyncio.Semaphore(CONCURRENCY[group])
+            async with _sems[group]:
+                return await fn(update, context)
+        return wrapper
+    return deco
+
 # ===== Access Control (2-step) =====
 session = {"stage": 0, "logged": False, "login_ts": 0}
 # stage: 0 = not started, 1 = login OK, waiting password, 2 = fully logged
@@ -67,12 +128,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🔐 {BOT_NAME} — приватный бот V3.\n"
         "Вход: `/login <логин>` → затем `/pass <пароль>`\n\n"
         "Команды:\n"
-        "• /status — статус интеграций\n"
+        "• /status — статус интеграций; /metrics — задержки и ошибки\n"
         "• /changelogin <новый>, /changepass <новый>\n"
-        "• /ask <вопрос>\n"
+        "• /ask <вопрос> (/ask! — без кэша)\n"
         "• /chat <сообщение> — диалог; /reset — сброс\n"
         "• /web <запрос>, /google <запрос>, /bing <запрос>, /wiki <термин>\n"
-        "• /quantum devices | preset <bell|ghz|qft> [qubits] | run <openqasm>\n"
+        "• /quantum devices | preset <bell|ghz|qft> [qubits] | run <openqasm> [--exact] [--profile=small|wide|mps|noisy|...]\n"
+        "• /quantum submit preset|run ... — фоновая задача; jobs | result <id> | cancel <id>\n"
+        "• /quantum sweep preset <тип> 3,5,8 | sweep run <openqasm> -- theta=0:3.14:5 [shots=N]\n"
         "• /logout — выйти",
         parse_mode=ParseMode.MARKDOWN
     )
@@ -137,21 +200,180 @@ async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @require_login
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    txt = llm_status() + "\n" + backends_info()
-    await update.message.reply_text(txt)
+    txt = llm_status() + "\n" + await asyncio.to_thread(backends_info) + "\n" + cache_stats() + "\n" + limits_stats() + "\n" + report()
+    await _reply_long(update, txt)
+
+# ===== Streaming replies: throttled edits of a placeholder, new message past TG_LIMIT =====
+async def _safe_edit(msg, text: str, final: bool = False):
+    # final: the text must land (last edit, or a chunk about to be left behind), so retry on flood control
+    while True:
+        try:
+            await msg.edit_text(text)
+            return
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            if not final:
+                return  # intermediate edit: skip it, a later one carries the same text
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+            return
+
+async def _stream_reply(update: Update, chunks):
+    msg = await update.message.reply_text("…")
+    text, last = "", time.monotonic()
+    try:
+        async for delta in chunks:
+            text += delta
+            while len(text) > TG_LIMIT:
+                cut = text.rfind("\n", 0, TG_LIMIT)
+                cut = cut if cut > 0 else TG_LIMIT
+                await _safe_edit(msg, text[:cut], final=True)
+                text = text[cut:].lstrip("\n")
+                msg = await update.message.reply_text("…")
+                last = time.monotonic()
+            if text and time.monotonic() - last >= STREAM_EDIT_INTERVAL:
+                await _safe_edit(msg, text)
+                last = time.monotonic()
+    except Exception as e:
+        log.exception("LLM stream failed: %s", redact(str(e)))
+        text = (text + "\n\n" if text else "") + "⚠️ Ошибка LLM."
+    await _safe_edit(msg, text or "(пустой ответ)", final=True)
+
+# ===== Large results: split into pages/chunks or attach as CSV/JSON/PNG; built off the event loop =====
+_ROW = re.compile(r"^([01 ]+): ([0-9.]+)$")  # "bitstring: count|probability" lines from modules.quantum
+_pages = TTLCache(256)
+
+def _split(text: str, limit: int = TG_LIMIT) -> List[str]:
+    pages, cur = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if cur:
+                pages.append(cur)
+                cur = ""
+            pages.append(line[:limit])
+            line = line[limit:]
+        if cur and len(cur) + 1 + len(line) > limit:
+            pages.append(cur)
+            cur = line
+        else:
+            cur = f"{cur}\n{line}" if cur else line
+    if cur:
+        pages.append(cur)
+    return pages
+
+def _table(text: str) -> Tuple[str, List[Tuple[str, float]]]:
+    head, rows = [], []
+    for line in text.split("\n"):
+        m = _ROW.match(line.strip())
+        if m:
+            rows.append((m.group(1), float(m.group(2))))
+        else:
+            head.append(line)
+    return "\n".join(head).strip(), rows
+
+def _histogram(title: str, rows: List[Tuple[str, float]]) -> bytes:
+    from matplotlib.figure import Figure  # no pyplot: safe to render from worker threads
+    top = sorted(rows, key=lambda r: r[1], reverse=True)[:64]
+    fig = Figure(figsize=(max(6, len(top) * 0.25), 4), dpi=120)
+    ax = fig.add_subplot()
+    ax.bar(range(len(top)), [v for _, v in top])
+    ax.set_xticks(range(len(top)), [k for k, _ in top], rotation=90, fontsize=6)
+    ax.set_title(title[:80] + (f" (top {len(top)} of {len(rows)})" if len(rows) > len(top) else ""), fontsize=8)
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+def _document(text: str, fmt: str = OUTPUT_FILE_FORMAT) -> Tuple[str, bytes, str]:
+    # -> (filename, content, caption); measurement tables become data files, anything else plain text
+    head, rows = _table(text)
+    caption = (head or "Результат")[:1000]
+    if rows and fmt == "png":
+        try:
+            return "histogram.png", _histogram(head.split("\n")[0], rows), caption
+        except ImportError:
+            fmt = "csv"
+    if rows and fmt == "json":
+        return "result.json", json.dumps({"title": head, "outcomes": dict(rows)}, ensure_ascii=False, indent=1).encode(), caption
+    if rows:
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(["outcome", "value"])
+        w.writerows(rows)
+        return "result.csv", buf.getvalue().encode(), caption
+    return "result.txt", text.encode(), caption[:200]
+
+def _pager(key: str, n: int, total: int) -> InlineKeyboardMarkup:
+    nav = []
+    if n > 0:
+        nav.append(InlineKeyboardButton("◀", callback_data=f"page:{key}:{n - 1}"))
+    nav.append(InlineKeyboardButton(f"{n + 1}/{total}", callback_data=f"page:{key}:{n}"))
+    if n < total - 1:
+        nav.append(InlineKeyboardButton("▶", callback_data=f"page:{key}:{n + 1}"))
+    return InlineKeyboardMarkup([nav, [InlineKeyboardButton("📎 Файлом", callback_data=f"page:{key}:file")]])
+
+async def _send_document(bot, chat_id: int, text: str):
+    name, data, caption = await asyncio.to_thread(_document, text)
+    await bot.send_document(chat_id, document=data, filename=name, caption=caption)
+
+async def _reply_long(update: Update, text: str, **kwargs):
+    """reply_text for results of any size: never fails on TG_LIMIT after the work is done."""
+    if len(text) <= TG_LIMIT:
+        await update.message.reply_text(text, **kwargs)
+        return
+    pages = await asyncio.to_thread(_split, text)
+    if OUTPUT_MODE == "file" or (OUTPUT_MODE == "chunks" and len(pages) > OUTPUT_MAX_CHUNKS):
+        await _send_document(update.get_bot(), update.effective_chat.id, text)
+    elif OUTPUT_MODE == "chunks":
+        for page in pages:
+            await update.message.reply_text(page, **kwargs)
+    else:
+        key = uuid.uuid4().hex[:10]
+        _pages.set(key, pages, OUTPUT_PAGES_TTL)
+        await update.message.reply_text(pages[0], reply_markup=_pager(key, 0, len(pages)), **kwargs)
+
+@require_login
+async def page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, key, action = query.data.split(":", 2)
+    found, pages = _pages.get(key)
+    if not found:
+        await query.answer("Страницы устарели — повтори команду.")
+        return
+    await query.answer()
+    if action == "file":
+        await _send_document(context.bot, query.message.chat_id, "\n".join(pages))
+        return
+    n = min(max(int(action), 0), len(pages) - 1)
+    try:
+        await query.edit_message_text(pages[n], reply_markup=_pager(key, n, len(pages)), disable_web_page_preview=True)
+    except BadRequest as e:
+        # The page counter button re-sends the current page
+        if "not modified" not in str(e).lower():
+            raise
+
+@require_login
+async def metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _reply_long(update, redact(metrics_summary()))
 
 @require_login
 async def ask(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
-        await update.message.reply_text("Использование: /ask <вопрос>")
+        await update.message.reply_text("Использование: /ask <вопрос> (или /ask! — без кэша)")
         return
     prompt = " ".join(context.args)
+    # "/ask!" arrives as the /ask command (Telegram ends the command entity at "!")
+    fresh = update.message.text.startswith("/ask!")
+    if LLM_STREAM:
+        await _stream_reply(update, ask_stream(prompt, fresh=fresh))
+        return
     try:
-        ans = await ask_once(prompt)
+        ans = await ask_once(prompt, fresh=fresh)
     except Exception as e:
         log.exception("ask_once failed: %s", redact(str(e)))
         ans = "⚠️ Ошибка LLM."
-    await update.message.reply_text(ans)
+    await _reply_long(update, ans)
 
 @require_login
 async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -159,12 +381,15 @@ async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /chat <сообщение>")
         return
     msg = " ".join(context.args)
+    if LLM_STREAM:
+        await _stream_reply(update, chat_stream(msg))
+        return
     try:
         ans = await chat_reply(msg)
     except Exception as e:
         log.exception("chat failed: %s", redact(str(e)))
         ans = "⚠️ Ошибка LLM."
-    await update.message.reply_text(ans)
+    await _reply_long(update, ans)
 
 @require_login
 async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -182,7 +407,7 @@ async def web(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         log.exception("web_search error: %s", redact(str(e)))
         res = "⚠️ Ошибка веб-поиска."
-    await update.message.reply_text(res, disable_web_page_preview=True)
+    await _reply_long(update, res, disable_web_page_preview=True)
 
 @require_login
 async def google(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -190,7 +415,7 @@ async def google(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /google <запрос>")
         return
     q = " ".join(context.args)
-    await update.message.reply_text(await google_search(q), disable_web_page_preview=True)
+    await _reply_long(update, await google_search(q), disable_web_page_preview=True)
 
 @require_login
 async def bing(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -198,7 +423,7 @@ async def bing(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /bing <запрос>")
         return
     q = " ".join(context.args)
-    await update.message.reply_text(await bing_search(q), disable_web_page_preview=True)
+    await _reply_long(update, await bing_search(q), disable_web_page_preview=True)
 
 @require_login
 async def wiki(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -206,29 +431,94 @@ async def wiki(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /wiki <термин>")
         return
     q = " ".join(context.args)
-    await update.message.reply_text(await wiki_summary(q), disable_web_page_preview=True)
+    await _reply_long(update, await wiki_summary(q), disable_web_page_preview=True)
+
+def _quantum_spec(args):
+    # args after preset|run -> job spec, or an error message
+    exact = "--exact" in args
+    profile = next((a.split("=", 1)[1].lower() for a in args if a.startswith("--profile=")), None)
+    if profile and profile != "auto" and profile not in AER_PROFILES:
+        return f"Неизвестный профиль Aer. Доступно: auto, {', '.join(AER_PROFILES)}."
+    args = [a for a in args if a != "--exact" and not a.startswith("--profile=")]
+    sub = args[0].lower() if args else ""
+    if sub == "preset":
+        if len(args) < 2:
+            return "Укажи тип: bell|ghz|qft"
+        preset = args[1]
+        qubits = int(args[2]) if len(args) > 2 else (2 if preset=='bell' else 3)
+        return {"preset": preset, "qubits": qubits, "exact": exact, "profile": profile}
+    if sub == "run":
+        qasm = " ".join(args[1:])
+        if not qasm.strip():
+            return "Пришли OpenQASM 3.0 после `run`."
+        return {"qasm": qasm, "exact": exact, "profile": profile}
+    return "Неизвестная подкоманда."
+
+def _sweep_values(text: str):
+    # "a:b:n" -> n evenly spaced points, "a-b" -> integer range, "a,b,c" -> list
+    if text.count(":") == 2:
+        a, b, n = text.split(":")
+        a, b, n = float(a), float(b), int(n)
+        return [a + (b - a) * i / (n - 1) for i in range(n)] if n > 1 else [a]
+    if "-" in text[1:] and "," not in text:
+        a, b = text.split("-", 1)
+        return list(range(int(a), int(b) + 1))
+    return [float(v) for v in text.split(",") if v]
+
+async def _quantum_sweep(args) -> str:
+    shots = 1024
+    if args and args[-1].startswith("shots="):
+        shots = int(args[-1].split("=", 1)[1])
+        args = args[:-1]
+    sub = args[0].lower() if args else ""
+    if sub == "preset" and len(args) >= 3:
+        return await sweep_preset(args[1], [int(v) for v in _sweep_values(args[2])], shots=shots)
+    if sub == "run" and "--" in args:
+        i = args.index("--")
+        qasm = " ".join(args[1:i])
+        grid = {}
+        for item in args[i + 1:]:
+            name, _, values = item.partition("=")
+            grid[name] = _sweep_values(values)
+        return await sweep_openqasm(qasm, grid, shots=shots)
+    return "Использование: /quantum sweep preset <bell|ghz|qft> 3,5,8 | sweep run <openqasm> -- theta=0:3.14:5 [shots=N]"
 
 @require_login
 async def quantum(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
-        await update.message.reply_text("Использование: /quantum devices | preset <bell|ghz|qft> [qubits] | run <openqasm>")
+        await update.message.reply_text("Использование: /quantum devices | preset <bell|ghz|qft> [qubits] | run <openqasm> | sweep ... | submit ... | jobs | result <id> | cancel <id>")
         return
     sub = context.args[0].lower()
     if sub == "devices":
-        await update.message.reply_text(backends_info())
-    elif sub == "preset":
+        await _reply_long(update, await asyncio.to_thread(backends_info))
+    elif sub in ("preset", "run"):
+        spec = _quantum_spec(context.args)
+        if isinstance(spec, str):
+            await update.message.reply_text(spec)
+        elif "preset" in spec:
+            await _reply_long(update, await run_preset_circuit(spec["preset"], spec["qubits"], spec["exact"], spec["profile"]))
+        else:
+            await _reply_long(update, await run_openqasm(spec["qasm"], spec["exact"], spec["profile"]))
+    elif sub == "submit":
+        spec = _quantum_spec(context.args[1:])
+        if isinstance(spec, str):
+            await update.message.reply_text(spec)
+        else:
+            await update.message.reply_text(await submit_job(update.effective_chat.id, spec))
+    elif sub == "sweep":
+        try:
+            res = await _quantum_sweep(context.args[1:])
+        except ValueError:
+            res = "Не удалось разобрать значения сетки."
+        await _reply_long(update, res)
+    elif sub == "jobs":
+        await _reply_long(update, list_jobs())
+    elif sub in ("result", "cancel"):
         if len(context.args) < 2:
-            await update.message.reply_text("Укажи тип: bell|ghz|qft")
-            return
-        preset = context.args[1]
-        qubits = int(context.args[2]) if len(context.args) > 2 else (2 if preset=='bell' else 3)
-        await update.message.reply_text(await run_preset_circuit(preset, qubits))
-    elif sub == "run":
-        qasm = " ".join(context.args[1:])
-        if not qasm.strip():
-            await update.message.reply_text("Пришли OpenQASM 3.0 после `run`.")
+            await update.message.reply_text(f"Использование: /quantum {sub} <id>")
             return
-        await update.message.reply_text(await run_openqasm(qasm))
+        job_id = context.args[1]
+        await _reply_long(update, job_result(job_id) if sub == "result" else await cancel_job(job_id))
     else:
         await update.message.reply_text("Неизвестная подкоманда.")
 
@@ -236,25 +526,61 @@ async def fallback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if _is_owner(update):
         await update.message.reply_text("Неизвестная команда. Введите /start")
 
-def main():
-    app = Application.builder().token(BOT_TOKEN).build()
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("login", login))
-    app.add_handler(CommandHandler("pass", passwd))
-    app.add_handler(CommandHandler("changelogin", changelogin))
-    app.add_handler(CommandHandler("changepass", changepass))
-    app.add_handler(CommandHandler("logout", logout))
-    app.add_handler(CommandHandler("status", status))
-    app.add_handler(CommandHandler("ask", ask))
-    app.add_handler(CommandHandler("chat", chat))
-    app.add_handler(CommandHandler("reset", reset))
-    app.add_handler(CommandHandler("web", web))
-    app.add_handler(CommandHandler("google", google))
-    app.add_handler(CommandHandler("bing", bing))
-    app.add_handler(CommandHandler("wiki", wiki))
-    app.add_handler(CommandHandler("quantum", quantum))
+async def _on_startup(app: Application):
+    await start_jobs(lambda chat_id, text: app.bot.send_message(chat_id, text))
+    log.info("startup %.0fms; %s", since_start() * 1000, report())
+    if PREWARM:
+        prewarm(load_llm_sdk, load_quantum_sdk)
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT, METRICS_HOST, sanitize=redact)
+
+async def _on_shutdown(app: Application):
+    await stop_jobs()
+    await close_clients()
+    shutdown_executors()
+
+def _command(name: str, fn, group: str = None) -> CommandHandler:
+    # Latency is measured around the concurrency limit, i.e. as the user sees it
+    return CommandHandler(name, instrument(f"cmd.{name}")(limited(group)(fn) if group else fn))
+
+def build_app() -> Application:
+    builder = Application.builder().token(BOT_TOKEN).concurrent_updates(UPDATE_CONCURRENCY)
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL)
+    app = builder.post_init(_on_startup).post_shutdown(_on_shutdown).build()
+    app.add_handler(_command("start", start))
+    app.add_handler(_command("login", login, "auth"))
+    app.add_handler(_command("pass", passwd, "auth"))
+    app.add_handler(_command("changelogin", changelogin, "auth"))
+    app.add_handler(_command("changepass", changepass, "auth"))
+    app.add_handler(_command("logout", logout, "auth"))
+    app.add_handler(_command("status", status))
+    app.add_handler(_command("metrics", metrics))
+    app.add_handler(_command("ask", ask, "llm"))
+    app.add_handler(_command("chat", chat, "chat"))
+    app.add_handler(_command("reset", reset, "chat"))
+    app.add_handler(_command("web", web, "web"))
+    app.add_handler(_command("google", google, "web"))
+    app.add_handler(_command("bing", bing, "web"))
+    app.add_handler(_command("wiki", wiki, "web"))
+    app.add_handler(_command("quantum", quantum, "quantum"))
+    app.add_handler(CallbackQueryHandler(instrument("cmd.page")(page), pattern=r"^page:"))
     app.add_handler(MessageHandler(filters.ALL, fallback))
-    app.run_polling(close_loop=False)
+    return app
+
+def main():
+    if TELEGRAM_MODE == "webhook" and not WEBHOOK_URL:
+        # Without a public URL Telegram is never told where to deliver updates
+        raise SystemExit("TELEGRAM_MODE=webhook requires WEBHOOK_URL (public https URL of this bot)")
+    app = build_app()
+    if TELEGRAM_MODE == "webhook":
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET, close_loop=False,
+        )
+    else:
+        app.run_polling(close_loop=False)
 
 if __name__ == "__main__":
-    asyncio.run(asyncio.to_thread(main))
+    main()
@@ -0,0 +1,163 @@
+import time, asyncio, threading, logging
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class _Op:
+    def __init__(self):
+        self.samples = deque(maxlen=1000)  # recent latencies for percentiles
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.bytes = 0
+
+    def pct(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        data = sorted(self.samples)
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+_ops: Dict[str, _Op] = defaultdict(_Op)
+_events: Dict[Tuple[str, str], int] = defaultdict(int)
+_gauges: Dict[Tuple[str, str], float] = {}
+_lock = threading.Lock()
+
+def observe(op: str, seconds: float, ok: bool = True, size: Optional[int] = None):
+    with _lock:
+        m = _ops[op]
+        m.samples.append(seconds)
+        m.count += 1
+        m.total += seconds
+        m.buckets[next((i for i, b in enumerate(BUCKETS) if seconds <= b), len(BUCKETS))] += 1
+        if not ok:
+            m.errors += 1
+        if size:
+            m.bytes += size
+
+def inc(event: str, op: str = ""):
+    with _lock:
+        _events[(event, op)] += 1
+
+def gauge(name: str, op: str, value: float):
+    # Current level (e.g. queue depth); kept across reset()
+    with _lock:
+        _gauges[(name, op)] = value
+
+class _Track:
+    size: Optional[int] = None
+    ok = True
+
+@contextmanager
+def track(op: str):
+    # with track("web.google") as t: ...; t.size = len(payload)
+    t, t0 = _Track(), time.perf_counter()
+    cancelled = False
+    try:
+        yield t
+    except asyncio.CancelledError:
+        # Hedged losers and shutdowns are neither successes nor errors
+        cancelled = True
+        raise
+    except BaseException:
+        t.ok = False
+        raise
+    finally:
+        if not cancelled:
+            observe(op, time.perf_counter() - t0, t.ok, t.size)
+
+def instrument(op: str, size: Optional[Callable] = None):
+    # Decorator for coroutines; size(result) -> payload bytes
+    def deco(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with track(op) as t:
+                res = await fn(*args, **kwargs)
+                if size is not None and res is not None:
+                    t.size = size(res)
+                return res
+        return wrapper
+    return deco
+
+def snapshot() -> Dict[str, dict]:
+    with _lock:
+        return {op: {"count": m.count, "errors": m.errors, "bytes": m.bytes,
+                     "p50": m.pct(0.5), "p95": m.pct(0.95), "p99": m.pct(0.99)} for op, m in _ops.items()}
+
+def reset():
+    with _lock:
+        _ops.clear()
+        _events.clear()
+
+def _fmt(v: Optional[float]) -> str:
+    return f"{v * 1000:.0f}ms" if v is not None else "—"
+
+def summary() -> str:
+    with _lock:
+        ops = sorted(_ops.items())
+        events = sorted(_events.items())
+        gauges = sorted(_gauges.items())
+    if not ops and not events:
+        return "📈 Метрик пока нет."
+    lines = ["📈 Метрики (p50 / p95 / p99, вызовы, ошибки):"]
+    for op, m in ops:
+        size = f", {m.bytes // max(1, m.count)}B/вызов" if m.bytes else ""
+        lines.append(f"• {op}: {_fmt(m.pct(0.5))} / {_fmt(m.pct(0.95))} / {_fmt(m.pct(0.99))}, {m.count}, {m.errors}{size}")
+    if events:
+        lines.append("События: " + ", ".join(f"{e}{'[' + op + ']' if op else ''}={n}" for (e, op), n in events))
+    if gauges:
+        lines.append("Сейчас: " + ", ".join(f"{g}[{op}]={v:g}" for (g, op), v in gauges))
+    return "\n".join(lines)
+
+def prometheus() -> str:
+    with _lock:
+        ops = sorted(_ops.items())
+        events = sorted(_events.items())
+        gauges = sorted(_gauges.items())
+    out = ["# TYPE bot_latency_seconds histogram"]
+    for op, m in ops:
+        acc = 0
+        for b, n in zip(BUCKETS, m.buckets):
+            acc += n
+            out.append(f'bot_latency_seconds_bucket{{op="{op}",le="{b}"}} {acc}')
+        out.append(f'bot_latency_seconds_bucket{{op="{op}",le="+Inf"}} {m.count}')
+        out.append(f'bot_latency_seconds_sum{{op="{op}"}} {m.total:.6f}')
+        out.append(f'bot_latency_seconds_count{{op="{op}"}} {m.count}')
+    out.append("# TYPE bot_errors_total counter")
+    out += [f'bot_errors_total{{op="{op}"}} {m.errors}' for op, m in ops]
+    out.append("# TYPE bot_payload_bytes_total counter")
+    out += [f'bot_payload_bytes_total{{op="{op}"}} {m.bytes}' for op, m in ops]
+    out.append("# TYPE bot_events_total counter")
+    out += [f'bot_events_total{{event="{e}",op="{op}"}} {n}' for (e, op), n in events]
+    for g in sorted({name for (name, _), _ in gauges}):
+        out.append(f"# TYPE bot_{g} gauge")
+        out += [f'bot_{g}{{op="{op}"}} {v:g}' for (name, op), v in gauges if name == g]
+    return "\n".join(out) + "\n"
+
+def serve(port: int, host: str = "127.0.0.1", sanitize: Callable[[str], str] = lambda s: s):
+    # Prometheus text endpoint in a daemon thread
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = sanitize(prometheus()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("metrics on http://%s:%d/metrics", host, port)
+    return server
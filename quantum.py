@@ -1,72 +1,973 @@
-import os
-from typing import Optional, List
-from qiskit import QuantumCircuit
-from qiskit_aer import AerSimulator
-from qiskit_ibm_runtime import QiskitRuntimeService, SamplerV2 as Sampler
-
-# Optional AWS Braket
-_BRK = None
-try:
-    from braket.circuits import Circuit as BraketCircuit
-    from braket.aws import AwsDevice, AwsDeviceType, AwsQuantumTask
-    _BRK = True
-except Exception:
-    _BRK = False
-
-def _ibm_service() -> Optional[QiskitRuntimeService]:
+from __future__ import annotations
+
+import os, json, time, hashlib, itertools, asyncio, threading, logging, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, List, Tuple, Dict, TYPE_CHECKING
+
+from modules.cache import TTLCache
+from modules.startup import timed
+from modules.metrics import instrument, track, inc
+from modules.limits import limiter, SingleFlight
+
+if TYPE_CHECKING:
+    from qiskit import QuantumCircuit
+    from qiskit_ibm_runtime import QiskitRuntimeService
+
+log = logging.getLogger(__name__)
+
+# ===== Lazy SDKs: qiskit stack loads on first quantum use (or prewarm), Braket only when configured =====
+_sdk_ready = False
+_BRK: Optional[bool] = None
+
+def load_sdk():
+    global _sdk_ready
+    if _sdk_ready:
+        return
+    with timed("qiskit"):
+        import qiskit  # noqa: F401
+    with timed("qiskit_aer"):
+        import qiskit_aer  # noqa: F401
+    if os.getenv("IBM_QUANTUM_TOKEN"):
+        # Only needed to reach IBM; imported lazily by _ibm_service otherwise
+        with timed("qiskit_ibm_runtime"):
+            import qiskit_ibm_runtime  # noqa: F401
+    _sdk_ready = True
+
+def _braket_available() -> bool:
+    # Optional AWS Braket
+    global _BRK
+    if _BRK is None:
+        try:
+            with timed("braket"):
+                import braket.circuits, braket.aws  # noqa: F401
+            _BRK = True
+        except Exception:
+            _BRK = False
+    return _BRK
+
+# ===== Executors: Aer and Braket LocalSimulator run in worker processes, IBM and AWS calls block threads =====
+QUANTUM_WORKERS = int(os.getenv("QUANTUM_WORKERS", "2"))
+QUANTUM_IBM_THREADS = int(os.getenv("QUANTUM_IBM_THREADS", "4"))
+QUANTUM_BRAKET_THREADS = int(os.getenv("QUANTUM_BRAKET_THREADS", "4"))
+QUANTUM_TIMEOUT = float(os.getenv("QUANTUM_TIMEOUT", "120"))
+QUANTUM_IBM_TIMEOUT = float(os.getenv("QUANTUM_IBM_TIMEOUT", "600"))
+QUANTUM_IBM_POLL = float(os.getenv("QUANTUM_IBM_POLL", "5"))
+QUANTUM_BRAKET_TIMEOUT = float(os.getenv("QUANTUM_BRAKET_TIMEOUT", "600"))
+
+_idle: List[ProcessPoolExecutor] = []  # warm single-process executors
+_busy: set = set()
+_slots: Optional[asyncio.Semaphore] = None
+_ibm_pool = ThreadPoolExecutor(max_workers=QUANTUM_IBM_THREADS, thread_name_prefix="ibm")
+# Status and cancel calls never queue behind submissions or result downloads
+_ibm_ctl_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ibm-ctl")
+_braket_pool = ThreadPoolExecutor(max_workers=QUANTUM_BRAKET_THREADS, thread_name_prefix="braket")
+
+def _kill(worker: ProcessPoolExecutor):
+    # A running simulation can't be cancelled, so terminate its process
+    for proc in list((getattr(worker, "_processes", None) or {}).values()):
+        proc.terminate()
+    worker.shutdown(wait=False, cancel_futures=True)
+
+async def _in_worker(fn, *args):
+    """fn(*args) in a worker process of its own (up to QUANTUM_WORKERS at once).
+
+    A timeout or cancellation kills only that worker, so other users' simulations keep running.
+    """
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(QUANTUM_WORKERS)
+    async with _slots:
+        worker = _idle.pop() if _idle else ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        _busy.add(worker)
+        try:
+            res = await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(worker, fn, *args), QUANTUM_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError, BrokenProcessPool):
+            _busy.discard(worker)
+            _kill(worker)
+            raise
+        except BaseException:
+            _busy.discard(worker)
+            _idle.append(worker)  # the simulation failed, the process is fine
+            raise
+        _busy.discard(worker)
+        _idle.append(worker)
+        return res
+
+def shutdown_executors():
+    for worker in _idle + list(_busy):
+        _kill(worker)
+    _idle.clear()
+    _busy.clear()
+    _ibm_pool.shutdown(wait=False, cancel_futures=True)
+    _ibm_ctl_pool.shutdown(wait=False, cancel_futures=True)
+    _braket_pool.shutdown(wait=False, cancel_futures=True)
+
+# ===== IBM: one long-lived service, backend list cached for QUANTUM_BACKENDS_TTL =====
+QUANTUM_BACKENDS_TTL = float(os.getenv("QUANTUM_BACKENDS_TTL", "300"))
+
+_svc: Optional[QiskitRuntimeService] = None
+_svc_lock = threading.Lock()
+_backends = {"ts": 0.0, "items": []}  # items: (backend, pending_jobs, simulator)
+
+def _ibm_service(refresh: bool = False) -> Optional[QiskitRuntimeService]:
+    global _svc
     token = os.getenv("IBM_QUANTUM_TOKEN")
     if not token:
         return None
+    load_sdk()
+    from qiskit_ibm_runtime import QiskitRuntimeService
+    with _svc_lock:
+        if _svc is None or refresh:
+            try:
+                _svc = QiskitRuntimeService(channel="ibm_quantum", token=token)
+            except Exception:
+                _svc = None
+        return _svc
+
+def _with_service(fn):
+    # Run fn(service); on failure reconnect once and retry
+    svc = _ibm_service()
+    if not svc:
+        return None
+    try:
+        return fn(svc)
+    except Exception:
+        svc = _ibm_service(refresh=True)
+        if not svc:
+            raise
+        return fn(svc)
+
+def _backend_entry(b):
+    try:
+        pending = b.status().pending_jobs
+    except Exception:
+        pending = None
+    try:
+        simulator = bool(b.configuration().simulator)
+    except Exception:
+        simulator = False
+    return b, pending, simulator
+
+def _ibm_backends(refresh: bool = False) -> list:
+    if not refresh and _backends["items"] and time.time() - _backends["ts"] < QUANTUM_BACKENDS_TTL:
+        return _backends["items"]
+    items = _with_service(lambda svc: [_backend_entry(b) for b in svc.backends(operational=True)])
+    if items is None:
+        return []
+    _backends.update(ts=time.time(), items=items)
+    return items
+
+def _num_qubits(b) -> int:
     try:
-        return QiskitRuntimeService(channel="ibm_quantum", token=token)
+        return int(b.num_qubits)
+    except Exception:
+        return 0
+
+def _least_busy(min_qubits: int = 0):
+    hw = _least_busy_entries(min_qubits)
+    return hw[0][0] if hw else None
+
+def _least_busy_entries(min_qubits: int = 0) -> list:
+    # Hardware backends large enough for the circuit, shortest queue first
+    hw = [e for e in _ibm_backends() if not e[2] and _num_qubits(e[0]) >= min_qubits]
+    return sorted(hw, key=lambda e: e[1] if e[1] is not None else float("inf"))
+
+# ===== AWS Braket: devices cached like IBM backends; LocalSimulator works offline =====
+QUANTUM_BRAKET_DEVICE = os.getenv("QUANTUM_BRAKET_DEVICE", "")  # ARN to always use instead of SV1/TN1
+QUANTUM_BRAKET_S3 = os.getenv("QUANTUM_BRAKET_S3", "")  # bucket/prefix; default is the SDK's amazon-braket-<region>-<account>
+QUANTUM_BRAKET_POLL = float(os.getenv("QUANTUM_BRAKET_POLL", "2"))
+
+_braket_devices_cache = {"ts": 0.0, "items": []}  # items: (device, queue_depth, simulator)
+
+def _braket_configured() -> bool:
+    return bool(os.getenv("AWS_REGION")) and _braket_available()
+
+def _queue_depth(device) -> Optional[int]:
+    try:
+        tasks = device.queue_depth().quantum_tasks
+        value = next((v for k, v in tasks.items() if "NORMAL" in str(k)), None)
+        # Braket reports strings such as "12" or ">4000"
+        return int(str(value).lstrip(">")) if value is not None else None
     except Exception:
         return None
 
-def _simulate_counts(qc: QuantumCircuit, shots: int = 1024) -> dict:
-    sim = AerSimulator()
-    result = sim.run(qc, shots=shots).result()
+def _braket_devices(refresh: bool = False) -> list:
+    if not _braket_configured():
+        return []
+    if not refresh and _braket_devices_cache["items"] and time.time() - _braket_devices_cache["ts"] < QUANTUM_BACKENDS_TTL:
+        return _braket_devices_cache["items"]
+    from braket.aws import AwsDevice
+    items = [(d, _queue_depth(d), str(d.type).upper().endswith("SIMULATOR"))
+             for d in AwsDevice.get_devices(statuses=["ONLINE"])]
+    _braket_devices_cache.update(ts=time.time(), items=items)
+    return items
+
+def _braket_qubits(device) -> int:
+    try:
+        return int(device.properties.paradigm.qubitCount)
+    except Exception:
+        return 0
+
+_BRAKET_GATES = {
+    "id": "i", "h": "h", "x": "x", "y": "y", "z": "z", "s": "s", "sdg": "si", "t": "t", "tdg": "ti",
+    "sx": "v", "sxdg": "vi", "rx": "rx", "ry": "ry", "rz": "rz", "p": "phaseshift",
+    "cx": "cnot", "cy": "cy", "cz": "cz", "cp": "cphaseshift", "swap": "swap",
+    "ccx": "ccnot", "cswap": "cswap", "rxx": "xx", "ryy": "yy", "rzz": "zz",
+}
+
+def _to_braket(qc: QuantumCircuit):
+    # -> (Braket circuit, {qubit: clbit} for measured qubits, number of clbits)
+    from braket.circuits import Circuit
+    src = (qc.metadata or {}).get("cache_key")
+    build = lambda: _braket_basis(qc)
+    basis = _cached_circuit(_cache_key(src, "braket"), build) if src else build()
+    circ, meas = Circuit(), {}
+    for inst in basis.data:
+        name = inst.operation.name
+        qubits = [basis.find_bit(q).index for q in inst.qubits]
+        if name == "measure":
+            meas[qubits[0]] = basis.find_bit(inst.clbits[0]).index
+        elif name != "barrier":
+            getattr(circ, _BRAKET_GATES[name])(*qubits, *[float(p) for p in inst.operation.params])
+    return circ, meas, basis.num_clbits
+
+def _braket_basis(qc: QuantumCircuit) -> QuantumCircuit:
+    from qiskit import transpile
+    return transpile(qc, basis_gates=list(_BRAKET_GATES) + ["measure", "barrier"], optimization_level=1)
+
+def _braket_counts(result, meas: Optional[dict] = None, n_clbits: Optional[int] = None) -> dict:
+    # Braket bitstrings are ordered like result.measured_qubits; Qiskit keys read clbit n-1 … 0.
+    # Without a mapping (tasks resumed by id) measured qubit k lands in clbit k.
+    measured = list(result.measured_qubits)
+    if meas is None:
+        meas, n_clbits = {q: q for q in measured}, (max(measured) + 1 if measured else 0)
+    pos = {q: k for k, q in enumerate(measured)}
+    out: Dict[str, int] = {}
+    for bits, n in result.measurement_counts.items():
+        cl = ["0"] * n_clbits
+        for q, c in meas.items():
+            if q in pos:
+                cl[c] = bits[pos[q]]
+        key = "".join(reversed(cl))
+        out[key] = out.get(key, 0) + n
+    return out
+
+def _braket_local_counts(qc: QuantumCircuit, shots: int = 1024) -> dict:
+    from braket.devices import LocalSimulator
+    circ, meas, n_clbits = _to_braket(qc)
+    return _braket_counts(LocalSimulator().run(circ, shots=shots).result(), meas, n_clbits)
+
+def _braket_task(qc: QuantumCircuit, shots: int, device):
+    circ, meas, n_clbits = _to_braket(qc)
+    kw = {}
+    if QUANTUM_BRAKET_S3:
+        bucket, _, prefix = QUANTUM_BRAKET_S3.partition("/")
+        kw["s3_destination_folder"] = (bucket, prefix or "bot")
+    return device.run(circ, shots=shots, **kw), meas, n_clbits
+
+def _braket_task_by_id(task_id: str):
+    from braket.aws import AwsQuantumTask
+    return AwsQuantumTask(task_id)
+
+def _is_braket_task(task_id: str) -> bool:
+    return task_id.startswith("arn:aws:braket")
+
+async def _braket_limit():
+    await limiter("braket", 2, 5).acquire()
+
+# ===== Backend selection: circuit size and expected queue wait =====
+QUANTUM_BACKEND = os.getenv("QUANTUM_BACKEND", "auto").lower()  # auto | aer | ibm | braket | braket_local
+QUANTUM_LOCAL_MAX_QUBITS = int(os.getenv("QUANTUM_LOCAL_MAX_QUBITS", "26"))
+QUANTUM_QUEUE_JOB_SECONDS = float(os.getenv("QUANTUM_QUEUE_JOB_SECONDS", "10"))  # assumed per queued job
+QUANTUM_MAX_WAIT = float(os.getenv("QUANTUM_MAX_WAIT", "900"))
+_BRAKET_SIMULATORS = {"SV1": 34, "TN1": 50}
+
+def _expected_wait(pending: Optional[int]) -> float:
+    return float("inf") if pending is None else pending * QUANTUM_QUEUE_JOB_SECONDS
+
+def _fits_local(qc: QuantumCircuit) -> bool:
+    # Clifford-only circuits run on Aer's stabilizer method at any size
+    ops = {inst.operation.name for inst in qc.data} - {"measure"}
+    return qc.num_qubits <= QUANTUM_LOCAL_MAX_QUBITS or ops <= _CLIFFORD
+
+def _braket_pick(qc: QuantumCircuit):
+    if QUANTUM_BRAKET_DEVICE:
+        from braket.aws import AwsDevice
+        return AwsDevice(QUANTUM_BRAKET_DEVICE)
+    sims = [(d, q) for d, q, sim in _braket_devices() if sim and qc.num_qubits <= _BRAKET_SIMULATORS.get(d.name, _braket_qubits(d))]
+    ok = [(d, q) for d, q in sims if _expected_wait(q or 0) <= QUANTUM_MAX_WAIT]
+    return min(ok, key=lambda e: (_BRAKET_SIMULATORS.get(e[0].name, 99), e[1] or 0))[0] if ok else None
+
+def _select_backend(qc: QuantumCircuit) -> Tuple[str, object]:
+    """-> (kind, target): ("ibm", backend) | ("braket", AwsDevice) | ("braket_local", None) | ("aer", None)."""
+    mode = QUANTUM_BACKEND
+    if mode == "aer":
+        return "aer", None
+    if mode == "braket_local" or (mode == "braket" and not _braket_configured()):
+        return ("braket_local", None) if _braket_available() else ("aer", None)
+    if mode == "braket":
+        device = _braket_pick(qc)
+        return ("braket", device) if device is not None else ("aer", None)
+    # auto / ibm: real hardware first when it fits and its queue is short enough
+    if _ibm_service():
+        hw = _least_busy_entries(qc.num_qubits)
+        if hw and (mode == "ibm" or _expected_wait(hw[0][1]) <= QUANTUM_MAX_WAIT):
+            return "ibm", hw[0][0]
+    if mode == "ibm" or _fits_local(qc):
+        return "aer", None
+    # Too large for local simulation: AWS SV1/TN1 if configured
+    if _braket_configured():
+        device = _braket_pick(qc)
+        if device is not None:
+            return "braket", device
+    return "aer", None
+
+# ===== Circuit cache: built/parsed and transpiled circuits, content-addressed =====
+QUANTUM_CIRCUIT_CACHE = int(os.getenv("QUANTUM_CIRCUIT_CACHE", "128"))
+QUANTUM_CIRCUIT_TTL = float(os.getenv("QUANTUM_CIRCUIT_TTL", "86400"))
+QUANTUM_QPY_DIR = os.getenv("QUANTUM_QPY_DIR", "")
+
+_circuits = TTLCache(QUANTUM_CIRCUIT_CACHE)
+
+def _cache_key(*parts) -> str:
+    return hashlib.sha256("\x00".join(map(str, parts)).encode()).hexdigest()
+
+def _qpy_path(key: str) -> str:
+    return os.path.join(QUANTUM_QPY_DIR, f"{key}.qpy")
+
+def _qpy_load(key: str) -> Optional[QuantumCircuit]:
+    if not QUANTUM_QPY_DIR or not os.path.exists(_qpy_path(key)):
+        return None
+    from qiskit import qpy
+    try:
+        with open(_qpy_path(key), "rb") as f:
+            return qpy.load(f)[0]
+    except Exception:
+        return None
+
+def _qpy_dump(key: str, qc: QuantumCircuit):
+    if not QUANTUM_QPY_DIR:
+        return
+    from qiskit import qpy
+    try:
+        os.makedirs(QUANTUM_QPY_DIR, exist_ok=True)
+        with open(_qpy_path(key), "wb") as f:
+            qpy.dump(qc, f)
+    except Exception:
+        pass
+
+def _cached_circuit(key: str, build) -> Optional[QuantumCircuit]:
+    found, qc = _circuits.get(key)
+    if found:
+        inc("cache_hit", "quantum.circuit")
+        return qc
+    inc("cache_miss", "quantum.circuit")
+    qc = _qpy_load(key)
+    if qc is None:
+        qc = build()
+        if qc is None:
+            return None
+        # Remember where the circuit came from so its transpiled form can be cached too
+        qc.metadata = {**(qc.metadata or {}), "cache_key": key}
+        _qpy_dump(key, qc)
+    _circuits.set(key, qc, QUANTUM_CIRCUIT_TTL)
+    return qc
+
+def _transpiled(qc: QuantumCircuit, backend) -> QuantumCircuit:
+    from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+    build = lambda: generate_preset_pass_manager(optimization_level=1, backend=backend).run(qc)
+    src = (qc.metadata or {}).get("cache_key")
+    if not src:
+        return build()
+    return _cached_circuit(_cache_key(src, backend.name), build)
+
+# ===== Aer profiles: method, threads, fusion and precision per workload; optional IBM noise model =====
+# Threads per simulation: QUANTUM_WORKERS processes already share the cores
+_AER_THREADS = int(os.getenv("QUANTUM_AER_THREADS", "0")) or max(1, (os.cpu_count() or 1) // max(1, QUANTUM_WORKERS))
+QUANTUM_AER_PROFILE = os.getenv("QUANTUM_AER_PROFILE", "auto").lower()  # auto | one of AER_PROFILES
+QUANTUM_AER_SMALL_QUBITS = int(os.getenv("QUANTUM_AER_SMALL_QUBITS", "14"))
+QUANTUM_AER_MPS_DEPTH = int(os.getenv("QUANTUM_AER_MPS_DEPTH", "20"))  # wide circuits this shallow go to MPS
+QUANTUM_AER_PROFILES_FILE = os.getenv("QUANTUM_AER_PROFILES_FILE", "")  # written by `python bench.py --aer all`
+QUANTUM_NOISE_BACKEND = os.getenv("QUANTUM_NOISE_BACKEND", "")  # IBM backend to emulate; default least busy
+QUANTUM_NOISE_TTL = float(os.getenv("QUANTUM_NOISE_TTL", "86400"))  # calibrations change about daily
+
+# AerSimulator options; "noise": True attaches the IBM noise model
+AER_PROFILES: Dict[str, dict] = {
+    "small": {"method": "statevector", "max_parallel_threads": 1},  # threading costs more than it saves here
+    "clifford": {"method": "stabilizer", "max_parallel_threads": 1},
+    "wide": {"method": "statevector", "precision": "single", "fusion_threshold": 14,
+             "max_parallel_threads": _AER_THREADS},
+    "mps": {"method": "matrix_product_state", "max_parallel_threads": _AER_THREADS},
+    "noisy": {"method": "automatic", "max_parallel_threads": _AER_THREADS, "max_parallel_shots": _AER_THREADS, "noise": True},
+}
+if QUANTUM_AER_PROFILES_FILE and os.path.exists(QUANTUM_AER_PROFILES_FILE):
+    try:
+        with open(QUANTUM_AER_PROFILES_FILE, encoding="utf-8") as f:
+            for _name, _opts in json.load(f).items():
+                AER_PROFILES[_name] = {**AER_PROFILES.get(_name, {}), **_opts}
+    except Exception:
+        log.exception("cannot load %s", QUANTUM_AER_PROFILES_FILE)
+if QUANTUM_AER_PROFILE != "auto" and QUANTUM_AER_PROFILE not in AER_PROFILES:
+    log.warning("unknown QUANTUM_AER_PROFILE=%s (expected auto or one of %s); using auto",
+                QUANTUM_AER_PROFILE, ", ".join(AER_PROFILES))
+    QUANTUM_AER_PROFILE = "auto"
+
+_noise = {"ts": 0.0, "model": None}  # model: (backend name, NoiseModel, coupling edges, num_qubits)
+_noise_lock = threading.Lock()
+
+def _noise_model(min_qubits: int = 0) -> Optional[tuple]:
+    with _noise_lock:
+        model = _noise["model"]
+        if model and model[3] >= min_qubits and time.time() - _noise["ts"] < QUANTUM_NOISE_TTL:
+            return model
+        if not _ibm_service():
+            return None
+        if QUANTUM_NOISE_BACKEND:
+            backend = _with_service(lambda svc: svc.backend(QUANTUM_NOISE_BACKEND))
+        else:
+            backend = _least_busy(min_qubits)
+        if backend is None:
+            return None
+        from qiskit_aer.noise import NoiseModel
+        edges = [list(e) for e in backend.coupling_map.get_edges()] if backend.coupling_map else None
+        model = (backend.name, NoiseModel.from_backend(backend), edges, _num_qubits(backend))
+        _noise.update(ts=time.time(), model=model)
+        return model
+
+def _aer_profile(qc: QuantumCircuit, requested: Optional[str] = None) -> str:
+    name = requested or QUANTUM_AER_PROFILE
+    if name != "auto":
+        return name
+    ops = {inst.operation.name for inst in qc.data} - {"measure"}
+    if ops <= _CLIFFORD:
+        return "clifford"
+    if qc.num_qubits <= QUANTUM_AER_SMALL_QUBITS:
+        return "small"
+    # Library gates (QFT etc.) count as one layer until decomposed
+    if qc.num_qubits > QUANTUM_LOCAL_MAX_QUBITS or qc.decompose(reps=2).depth() <= QUANTUM_AER_MPS_DEPTH:
+        return "mps"
+    return "wide"
+
+def _aer_plan(qc: QuantumCircuit, requested: Optional[str] = None) -> Tuple[str, dict]:
+    """-> (profile, options for _simulate_*); may call IBM for the noise model, so run it off the event loop."""
+    name = _aer_profile(qc, requested)
+    options = dict(AER_PROFILES[name])
+    if options.pop("noise", False):
+        noise = _noise_model(qc.num_qubits)
+        if noise is None:
+            raise RuntimeError(f"Нет модели шума для {qc.num_qubits} кубитов: нужен IBM_QUANTUM_TOKEN и подходящий бэкенд.")
+        options["noise"] = noise
+    return name, options
+
+# Transpiled-for-Aer circuits, per worker process: library gates are not Aer instructions
+_aer_ready: Dict[tuple, QuantumCircuit] = {}
+
+def _aer_circuit(qc: QuantumCircuit, sim, noise: Optional[tuple]) -> QuantumCircuit:
+    from qiskit import transpile
+    key = ((qc.metadata or {}).get("cache_key"), noise[0] if noise else None)
+    if key[0] and key in _aer_ready:
+        return _aer_ready[key]
+    if noise:
+        # The device's basis and coupling map, so the noise model's gate errors apply
+        from qiskit.transpiler import CouplingMap
+        out = transpile(qc, basis_gates=noise[1].basis_gates, optimization_level=1,
+                        coupling_map=CouplingMap(noise[2]) if noise[2] else None)
+    else:
+        out = transpile(qc, sim, optimization_level=0)
+    if key[0]:
+        if len(_aer_ready) >= 32:
+            _aer_ready.pop(next(iter(_aer_ready)))
+        _aer_ready[key] = out
+    return out
+
+def _aer_simulator(options: dict):
+    from qiskit_aer import AerSimulator
+    options = dict(options)
+    noise = options.pop("noise", None)
+    return AerSimulator(noise_model=noise[1], **options) if noise else AerSimulator(**options)
+
+def _simulate_counts(qc: QuantumCircuit, shots: int = 1024, options: Optional[dict] = None) -> dict:
+    options = options or {}
+    sim = _aer_simulator(options)
+    result = sim.run(_aer_circuit(qc, sim, options.get("noise")), shots=shots).result()
     return result.get_counts()
 
+# pubs: (circuit, parameter rows or None); one Aer job for all bound circuits
+def _simulate_batch(pubs: list, shots: int = 1024, options: Optional[dict] = None) -> List[dict]:
+    options = options or {}
+    sim = _aer_simulator(options)
+    circuits = []
+    for qc, rows in pubs:
+        qc = _aer_circuit(qc, sim, options.get("noise"))
+        circuits.extend([qc.assign_parameters(r) for r in rows] if rows else [qc])
+    result = sim.run(circuits, shots=shots).result()
+    return [result.get_counts(i) for i in range(len(circuits))]
+
+# Micro-benchmark: candidate settings per profile on a representative circuit; the fastest become its defaults
+_AER_BENCH = {"small": ("qft", 10), "clifford": ("ghz", 40), "wide": ("qft", 20), "mps": ("ghz_ry", 40), "noisy": ("qft", 6)}
+_THREADS_GRID = sorted({1, _AER_THREADS})
+_AER_GRID = {
+    "small": {"max_parallel_threads": _THREADS_GRID, "fusion_enable": [True, False]},
+    "clifford": {"max_parallel_threads": _THREADS_GRID},
+    "wide": {"precision": ["single", "double"], "fusion_threshold": [10, 14, 18], "max_parallel_threads": _THREADS_GRID},
+    "mps": {"max_parallel_threads": _THREADS_GRID, "mps_sample_measure_algorithm": ["mps_apply_measure", "mps_probabilities"]},
+    "noisy": {"max_parallel_threads": _THREADS_GRID, "max_parallel_shots": _THREADS_GRID},
+}
+
+def _bench_circuit(kind: str, qubits: int) -> QuantumCircuit:
+    if kind != "ghz_ry":
+        qc = _build_preset(kind, qubits)
+    else:
+        # Non-Clifford but weakly entangled: GHZ chain with a rotation layer
+        qc = _build_preset("ghz", qubits).remove_final_measurements(inplace=False)
+        for q in range(qubits):
+            qc.ry(0.1 * (q + 1), q)
+        qc.measure_all()
+    qc.metadata = {"cache_key": _cache_key("bench", kind, qubits)}  # transpile once, time the simulation
+    return qc
+
+def _bench_noise(qubits: int) -> tuple:
+    # Used when no IBM model is available: depolarizing errors on a typical basis
+    from qiskit_aer.noise import NoiseModel, depolarizing_error
+    nm = NoiseModel(basis_gates=["cx", "rz", "sx", "x"])
+    nm.add_all_qubit_quantum_error(depolarizing_error(0.001, 1), ["rz", "sx", "x"])
+    nm.add_all_qubit_quantum_error(depolarizing_error(0.01, 2), ["cx"])
+    return "depolarizing", nm, None, qubits
+
+def aer_microbench(name: str, qubits: Optional[int] = None, shots: int = 1024, repeats: int = 3) -> dict:
+    """Times every candidate in _AER_GRID[name] (best of `repeats`) -> {"best": options, "runs": [...]}."""
+    load_sdk()
+    kind, default_qubits = _AER_BENCH[name]
+    qc = _bench_circuit(kind, qubits or default_qubits)
+    base = dict(AER_PROFILES[name])
+    if base.pop("noise", False):
+        base["noise"] = _noise_model(qc.num_qubits) or _bench_noise(qc.num_qubits)
+    grid = _AER_GRID[name]
+    runs = []
+    for values in itertools.product(*grid.values()):
+        candidate = dict(zip(grid, values))
+        options = {**base, **candidate}
+        _simulate_counts(qc, shots, options)  # transpile and warm up
+        best = float("inf")
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            _simulate_counts(qc, shots, options)
+            best = min(best, time.perf_counter() - t0)
+        runs.append({"options": candidate, "seconds": round(best, 4)})
+    runs.sort(key=lambda r: r["seconds"])
+    return {"profile": name, "circuit": f"{kind} {qc.num_qubits}", "best": runs[0]["options"], "runs": runs}
+
+# ===== Exact mode: probabilities instead of shots for small or Clifford-only circuits =====
+QUANTUM_EXACT_AUTO = os.getenv("QUANTUM_EXACT_AUTO", "1") == "1"
+QUANTUM_EXACT_MAX_QUBITS = int(os.getenv("QUANTUM_EXACT_MAX_QUBITS", "20"))
+QUANTUM_EXACT_TOPK = int(os.getenv("QUANTUM_EXACT_TOPK", "16"))
+QUANTUM_EXACT_MAX_OUTCOMES_LOG2 = 16
+
+_CLIFFORD = {"h", "s", "sdg", "x", "y", "z", "sx", "sxdg", "cx", "cy", "cz", "swap", "id", "barrier"}
+
+def _exact_method(qc: QuantumCircuit) -> Optional[str]:
+    # Only unitary circuits with terminal measurements have a well-defined exact distribution
+    stripped = qc.remove_final_measurements(inplace=False)
+    ops = {inst.operation.name for inst in stripped.data}
+    if "measure" in ops or ops & {"reset", "if_else", "while_loop", "for_loop", "switch_case", "initialize"}:
+        return None
+    if ops <= _CLIFFORD:
+        return "stabilizer"
+    if qc.num_qubits <= QUANTUM_EXACT_MAX_QUBITS:
+        return "statevector"
+    return None
+
+def _gf2_rank(m) -> int:
+    m = m.copy()
+    rank = 0
+    for col in range(m.shape[1]):
+        piv = [r for r in range(rank, m.shape[0]) if m[r, col]]
+        if not piv:
+            continue
+        m[[rank, piv[0]]] = m[[piv[0], rank]]
+        for r in range(m.shape[0]):
+            if r != rank and m[r, col]:
+                m[r] ^= m[rank]
+        rank += 1
+    return rank
+
+def _exact_probs(qc: QuantumCircuit, method: str) -> Optional[dict]:
+    from qiskit.quantum_info import Statevector, StabilizerState
+    # Measured qubits ordered by classical bit, so keys read like Aer counts
+    measured = sorted((qc.find_bit(inst.clbits[0]).index, qc.find_bit(inst.qubits[0]).index)
+                      for inst in qc.data if inst.operation.name == "measure")
+    qargs = [q for _, q in measured] or list(range(qc.num_qubits))
+    stripped = qc.remove_final_measurements(inplace=False)
+    if method == "stabilizer":
+        state = StabilizerState(stripped)
+        # Support of the distribution is 2^rank(X-part); refuse to enumerate huge uniform supports
+        if min(_gf2_rank(state.clifford.stab_x), len(qargs)) > QUANTUM_EXACT_MAX_OUTCOMES_LOG2:
+            return None
+        return state.probabilities_dict(qargs)
+    return Statevector(stripped).probabilities_dict(qargs)
+
+def _format_probs(method: str, probs: dict, topk: int) -> str:
+    items = sorted(probs.items(), key=lambda kv: kv[1], reverse=True)
+    lines = [f"🎯 Точные вероятности ({method}):"] + [f"{k}: {v:.4f}" for k, v in items[:topk]]
+    rest = items[topk:]
+    if rest:
+        lines.append(f"… ещё {len(rest)} исходов (Σ {sum(v for _, v in rest):.4f})")
+    return "\n".join(lines)
+
+def _exact_text(qc: QuantumCircuit, method: str, topk: int) -> Optional[str]:
+    probs = _exact_probs(qc, method)
+    return _format_probs(method, probs, topk) if probs is not None else None
+
 def _format_counts(counts: dict) -> str:
     return "\n".join(f"{k}: {v}" for k, v in sorted(counts.items(), key=lambda kv: kv[1], reverse=True)) or "нет результатов"
 
 def backends_info() -> str:
     info = ["⚛️ Доступные бэкенды:"]
-    svc = _ibm_service()
-    if svc:
+    if _ibm_service():
         try:
-            bks = [b.name for b in svc.backends(operational=True)]
-            info.append("• IBM: " + (", ".join(bks[:10]) + (" ..." if len(bks) > 10 else "")))
+            items = sorted(_ibm_backends(), key=lambda e: e[1] if e[1] is not None else float("inf"))
+            bks = [f"{b.name} ({pending})" if pending is not None else b.name for b, pending, _ in items]
+            info.append("• IBM (очередь): " + (", ".join(bks[:10]) + (" ..." if len(bks) > 10 else "")))
         except Exception:
             info.append("• IBM: доступ есть, но список не получен")
     else:
         info.append("• IBM: ❌ нет токена")
 
-    if _BRK and os.getenv("AWS_REGION"):
+    if _braket_configured():
         try:
-            # Список устройств (статический набор ARN известен на стороне AWS Braket документации; здесь укажем ключевые)
-            devices = [
-                "arn:aws:braket:::device/quantum-simulator/amazon/sv1",
-                "arn:aws:braket:::device/quantum-simulator/amazon/tn1",
-                # Реальные провайдеры доступны из консоли; перечислим часто используемые:
-                "arn:aws:braket:us-east-1::device/qpu/ionq/Aria-1",
-                "arn:aws:braket:us-west-1::device/qpu/rigetti/Aspen-M-3",
-                "arn:aws:braket:us-west-2::device/qpu/d-wave/Advantage_system6"
-            ]
-            info.append("• AWS Braket: " + ", ".join(devices[:5]))
+            items = sorted(_braket_devices(), key=lambda e: (not e[2], e[1] if e[1] is not None else float("inf")))
+            devs = [f"{d.name} ({depth})" if depth is not None else d.name for d, depth, _ in items]
+            info.append("• AWS Braket (очередь): " + (", ".join(devs[:10]) + (" ..." if len(devs) > 10 else "")))
         except Exception:
             info.append("• AWS Braket: модуль есть, но список не получен")
+    elif _braket_available():
+        info.append("• AWS Braket: LocalSimulator (офлайн); SV1/TN1 — после настройки AWS_REGION")
     else:
         info.append("• AWS Braket: ❌ не настроен")
+    info.append(f"• Выбор бэкенда: {QUANTUM_BACKEND}")
+    noise = _noise["model"][0] if _noise["model"] else "—"
+    info.append(f"• Aer: профиль {QUANTUM_AER_PROFILE} ({', '.join(AER_PROFILES)}), {_AER_THREADS} потоков на задачу, модель шума: {noise}")
     return "\n".join(info)
 
-async def run_preset_circuit(kind: str, qubits: int) -> str:
-    kind = kind.lower()
+@instrument("quantum.aer")
+async def _aer_counts(qc: QuantumCircuit, shots: int = 1024, profile: Optional[str] = None) -> Tuple[str, dict]:
+    name, options = await asyncio.to_thread(_aer_plan, qc, profile)
+    with track(f"quantum.aer.{name}"):
+        counts = await _in_worker(_simulate_counts, qc, shots, options)
+    if options.get("noise"):
+        name = f"{name}, шум {options['noise'][0]}"
+    return name, counts
+
+def _ibm_submit(qc: QuantumCircuit, shots: int = 1024, backend=None):
+    if not _ibm_service():
+        return None
+    backend = backend or _least_busy(qc.num_qubits)
+    if backend is None:
+        return None
+    from qiskit_ibm_runtime import SamplerV2 as Sampler
+    return backend.name, Sampler(mode=backend).run([_transpiled(qc, backend)], shots=shots)
+
+def _ibm_job(job_id: str):
+    job = _with_service(lambda svc: svc.job(job_id))
+    if job is None:
+        raise RuntimeError("IBM service unavailable")
+    return job
+
+def _job_counts(job) -> dict:
+    return job.result()[0].join_data().get_counts()
+
+def _ibm_submit_batch(pubs: list, shots: int = 1024, backend=None):
+    if not _ibm_service():
+        return None
+    backend = backend or _least_busy(max(qc.num_qubits for qc, _ in pubs))
+    if backend is None:
+        return None
+    ibm_pubs = [(_transpiled(qc, backend), rows) if rows else (_transpiled(qc, backend),) for qc, rows in pubs]
+    from qiskit_ibm_runtime import SamplerV2 as Sampler
+    return backend.name, Sampler(mode=backend).run(ibm_pubs, shots=shots)
+
+def _job_batch_counts(job, pubs: list) -> List[dict]:
+    out = []
+    for res, (_, rows) in zip(job.result(), pubs):
+        data = res.join_data()
+        out.extend([data.get_counts(loc=i) for i in range(len(rows))] if rows else [data.get_counts()])
+    return out
+
+# IBM Runtime API calls per second (IBM_RPS / IBM_BURST override, 0 = off); only taken when a token is set
+async def _ibm_limit() -> bool:
+    if not os.getenv("IBM_QUANTUM_TOKEN"):
+        return False
+    await limiter("ibm", 1, 3).acquire()
+    return True
+
+@instrument("quantum.ibm")
+async def _ibm_counts(qc: QuantumCircuit, shots: int = 1024, backend=None) -> Optional[Tuple[str, dict]]:
+    if not await _ibm_limit():
+        return None
+    loop = asyncio.get_running_loop()
+    submitted = await loop.run_in_executor(_ibm_pool, _ibm_submit, qc, shots, backend)
+    if not submitted:
+        return None
+    name, job = submitted
+    await _ibm_wait(job)
+    return name, await loop.run_in_executor(_ibm_pool, _job_counts, job)
+
+def _ibm_state(job) -> str:
+    st = job.status()
+    return str(getattr(st, "name", st)).upper()
+
+async def _ibm_wait(job):
+    # Poll the job state without holding a thread while it sits in the IBM queue; cancel it on timeout
+    loop = asyncio.get_running_loop()
+    deadline = time.monotonic() + QUANTUM_IBM_TIMEOUT
+    try:
+        while True:
+            await _ibm_limit()
+            state = await loop.run_in_executor(_ibm_ctl_pool, _ibm_state, job)
+            if state == "DONE":
+                return
+            if state in ("ERROR", "CANCELLED"):
+                raise RuntimeError(f"IBM job {state}")
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(QUANTUM_IBM_POLL)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        try:
+            await loop.run_in_executor(_ibm_ctl_pool, job.cancel)
+        except Exception:
+            pass
+        raise
+
+@instrument("quantum.braket")
+async def _braket_run(qc: QuantumCircuit, shots: int = 1024, device=None) -> Tuple[str, dict]:
+    loop = asyncio.get_running_loop()
+    if device is None:
+        return "LocalSimulator", await _in_worker(_braket_local_counts, qc, shots)
+    await _braket_limit()
+    task, meas, n_clbits = await loop.run_in_executor(_braket_pool, _braket_task, qc, shots, device)
+    # Poll the task state without holding a thread while it sits in the AWS queue
+    deadline = time.monotonic() + QUANTUM_BRAKET_TIMEOUT
+    try:
+        while True:
+            await _braket_limit()
+            state = await loop.run_in_executor(_braket_pool, task.state)
+            if state == "COMPLETED":
+                break
+            if state in ("FAILED", "CANCELLED"):
+                raise RuntimeError(f"Braket task {state}")
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(QUANTUM_BRAKET_POLL)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        try:
+            await loop.run_in_executor(_braket_pool, task.cancel)
+        except Exception:
+            pass
+        raise
+    result = await loop.run_in_executor(_braket_pool, task.result)
+    return device.name, _braket_counts(result, meas, n_clbits)
+
+async def _execute(qc: QuantumCircuit, exact: bool = False, profile: Optional[str] = None) -> str:
+    # An explicit Aer profile means "simulate locally like this", e.g. noisy emulation before paying for IBM time
+    if exact or profile:
+        try:
+            return await run_local(qc, shots=1024, exact=True if exact else None, profile=profile)
+        except RuntimeError as e:
+            return f"⚠️ {e}"
+        except asyncio.TimeoutError:
+            return f"⏱️ Симуляция превысила лимит {QUANTUM_TIMEOUT:.0f} с и была остановлена."
+        except BrokenProcessPool:
+            return "⚠️ Процесс симуляции аварийно завершился (возможно, не хватило памяти). Повтори команду."
+
+    try:
+        # Planning stays off _ibm_pool, which is reserved for blocking IBM calls
+        kind, target = await asyncio.to_thread(_select_backend, qc)
+    except Exception:
+        log.warning("backend selection failed", exc_info=True)
+        kind, target = "aer", None
+    try:
+        if kind == "ibm":
+            ibm = await _ibm_counts(qc, shots=1024, backend=target)
+            if ibm:
+                return f"🧪 IBM ({ibm[0]}):\n{_format_counts(ibm[1])}"
+        elif kind in ("braket", "braket_local"):
+            name, counts = await _braket_run(qc, shots=1024, device=target)
+            return f"🧪 Braket ({name}):\n{_format_counts(counts)}"
+    except Exception as e:
+        log.warning("%s run failed, falling back to Aer: %s", kind, type(e).__name__)
+
+    # Fallback: local Aer
+    try:
+        return await run_local(qc, shots=1024)
+    except RuntimeError as e:
+        return f"⚠️ {e}"
+    except asyncio.TimeoutError:
+        return f"⏱️ Симуляция превысила лимит {QUANTUM_TIMEOUT:.0f} с и была остановлена."
+    except BrokenProcessPool:
+        return "⚠️ Процесс симуляции аварийно завершился (возможно, не хватило памяти). Повтори команду."
+
+# ===== Batches and sweeps: N circuits in one Aer run or one multi-PUB Sampler job =====
+QUANTUM_SWEEP_MAX = int(os.getenv("QUANTUM_SWEEP_MAX", "64"))
+
+@instrument("quantum.batch")
+async def run_batch(pubs: list, shots: int = 1024) -> Tuple[str, List[dict]]:
+    loop = asyncio.get_running_loop()
+    widest = max((qc for qc, _ in pubs), key=lambda qc: qc.num_qubits)
+    try:
+        # Same policy as single runs (QUANTUM_BACKEND, QUANTUM_MAX_WAIT); Braket has no multi-PUB jobs, so anything but IBM runs on Aer
+        kind, target = await asyncio.to_thread(_select_backend, widest)
+    except Exception:
+        log.warning("backend selection failed", exc_info=True)
+        kind, target = "aer", None
+    try:
+        submitted = None
+        if kind == "ibm" and await _ibm_limit():
+            submitted = await loop.run_in_executor(_ibm_pool, _ibm_submit_batch, pubs, shots, target)
+        if submitted:
+            name, job = submitted
+            await _ibm_wait(job)
+            return f"IBM ({name})", await loop.run_in_executor(_ibm_pool, _job_batch_counts, job, pubs)
+    except Exception as e:
+        # IBM error or QUANTUM_IBM_TIMEOUT (the job is cancelled above): the sweep still gets an answer
+        log.warning("IBM batch failed, simulating locally: %s", type(e).__name__, exc_info=True)
+        fallback = "; IBM недоступен — посчитано локально"
+    else:
+        fallback = ""
+
+    name, options = await asyncio.to_thread(_aer_plan, widest, None)
+    return f"AerSimulator (local, {name}{fallback})", await _in_worker(_simulate_batch, pubs, shots, options)
+
+def _format_table(title: str, labels: List[str], counts: List[dict]) -> str:
+    lines = [title]
+    for label, c in zip(labels, counts):
+        total = sum(c.values()) or 1
+        top = sorted(c.items(), key=lambda kv: kv[1], reverse=True)[:2]
+        cells = " | ".join(f"{k} {100 * v / total:.1f}%" for k, v in top)
+        lines.append(f"{label}: {cells}  (исходов: {len(c)})")
+    return "\n".join(lines)
+
+def _too_many(points: int) -> Optional[str]:
+    if points > QUANTUM_SWEEP_MAX:
+        return f"Слишком много точек: {points} (максимум {QUANTUM_SWEEP_MAX})."
+    return None
+
+async def _run_sweep(title: str, pubs: list, labels: List[str], shots: int) -> str:
+    try:
+        backend, counts = await run_batch(pubs, shots=shots)
+    except RuntimeError as e:
+        return f"⚠️ {e}"
+    except asyncio.TimeoutError:
+        return f"⏱️ Симуляция превысила лимит {QUANTUM_TIMEOUT:.0f} с и была остановлена."
+    except BrokenProcessPool:
+        return "⚠️ Процесс симуляции аварийно завершился (возможно, не хватило памяти). Повтори команду."
+    return _format_table(f"📊 {title} — {backend}, 1 задача, {len(labels)} схем, {shots} shots:", labels, counts)
+
+async def sweep_preset(kind: str, qubit_counts: List[int], shots: int = 1024) -> str:
+    if _too_many(len(qubit_counts)):
+        return _too_many(len(qubit_counts))
+    circuits = await asyncio.to_thread(lambda: [build_preset(kind, n) for n in qubit_counts])
+    if any(qc is None for qc in circuits):
+        return "Неизвестный пресет. Доступно: bell, ghz, qft."
+    return await _run_sweep(f"Sweep {kind.lower()}", [(qc, None) for qc in circuits],
+                            [f"n={qc.num_qubits}" for qc in circuits], shots)
+
+async def sweep_openqasm(qasm_text: str, grid: Dict[str, List[float]], shots: int = 1024) -> str:
+    try:
+        qc = await asyncio.to_thread(parse_qasm, qasm_text)
+    except Exception as e:
+        return f"Ошибка парсинга OpenQASM 3.0: {e}"
+    names = [p.name for p in qc.parameters]
+    missing = [n for n in names if n not in grid]
+    extra = [n for n in grid if n not in names]
+    if missing or extra:
+        return f"Параметры схемы: {', '.join(names) or 'нет'}. Не заданы: {', '.join(missing) or '—'}; лишние: {', '.join(extra) or '—'}."
+    if not names:
+        return await _run_sweep("Sweep openqasm", [(qc, None)], ["—"], shots)
+    points = 1
+    for n in names:
+        points *= len(grid[n])
+    if _too_many(points):
+        return _too_many(points)
+    rows = [list(r) for r in itertools.product(*(grid[n] for n in names))]
+    labels = [", ".join(f"{n}={v:g}" for n, v in zip(names, r)) for r in rows]
+    return await _run_sweep("Sweep openqasm", [(qc, rows)], labels, shots)
+
+# ===== Building blocks for the job queue (modules/jobs.py) =====
+# Submit to IBM or AWS Braket without waiting; returns (backend name, job id) or None to run locally.
+# Braket task ids are ARNs, which is how the functions below tell the two apart.
+async def submit_remote(qc: QuantumCircuit, shots: int = 1024) -> Optional[Tuple[str, str]]:
+    loop = asyncio.get_running_loop()
+    try:
+        kind, target = await asyncio.to_thread(_select_backend, qc)
+        if kind == "braket":
+            await _braket_limit()
+            task, _, _ = await loop.run_in_executor(_braket_pool, _braket_task, qc, shots, target)
+            return target.name, task.id
+        if kind != "ibm" or not await _ibm_limit():
+            return None
+        submitted = await loop.run_in_executor(_ibm_pool, _ibm_submit, qc, shots, target)
+    except Exception:
+        return None
+    if not submitted:
+        return None
+    name, job = submitted
+    return name, job.job_id()
+
+_BRAKET_STATES = {"COMPLETED": "DONE", "FAILED": "ERROR", "CANCELLING": "CANCELLED", "CANCELLED": "CANCELLED"}
+
+async def remote_status(job_id: str) -> str:
+    loop = asyncio.get_running_loop()
+    if _is_braket_task(job_id):
+        await _braket_limit()
+        task = await loop.run_in_executor(_braket_pool, _braket_task_by_id, job_id)
+        state = await loop.run_in_executor(_braket_pool, task.state)
+        return _BRAKET_STATES.get(state, state)
+    await _ibm_limit()
+    job = await loop.run_in_executor(_ibm_ctl_pool, _ibm_job, job_id)
+    return await loop.run_in_executor(_ibm_ctl_pool, _ibm_state, job)
+
+async def remote_result(job_id: str, backend: str) -> str:
+    loop = asyncio.get_running_loop()
+    if _is_braket_task(job_id):
+        await _braket_limit()
+        task = await loop.run_in_executor(_braket_pool, _braket_task_by_id, job_id)
+        result = await loop.run_in_executor(_braket_pool, task.result)
+        return f"🧪 Braket ({backend}):\n{_format_counts(_braket_counts(result))}"
+    await _ibm_limit()
+    job = await loop.run_in_executor(_ibm_pool, _ibm_job, job_id)
+    counts = await loop.run_in_executor(_ibm_pool, _job_counts, job)
+    return f"🧪 IBM ({backend}):\n{_format_counts(counts)}"
+
+async def cancel_remote(job_id: str):
+    loop = asyncio.get_running_loop()
+    if _is_braket_task(job_id):
+        await _braket_limit()
+        task = await loop.run_in_executor(_braket_pool, _braket_task_by_id, job_id)
+        await loop.run_in_executor(_braket_pool, task.cancel)
+        return
+    await _ibm_limit()
+    job = await loop.run_in_executor(_ibm_ctl_pool, _ibm_job, job_id)
+    await loop.run_in_executor(_ibm_ctl_pool, job.cancel)
+
+# exact: True forces exact probabilities, None applies QUANTUM_EXACT_AUTO (not with an explicit profile), False always samples
+async def run_local(qc: QuantumCircuit, shots: int = 1024, exact: Optional[bool] = None, profile: Optional[str] = None) -> str:
+    method = _exact_method(qc) if exact or (exact is None and QUANTUM_EXACT_AUTO and not profile) else None
+    if method:
+        with track(f"quantum.exact.{method}"):
+            text = await _in_worker(_exact_text, qc, method, QUANTUM_EXACT_TOPK)
+        if text:
+            return text
+    name, counts = await _aer_counts(qc, shots=shots, profile=profile)
+    note = "\n(точный режим недоступен для этой схемы)" if exact else ""
+    return f"🧪 AerSimulator (local, {name}):\n{_format_counts(counts)}{note}"
+
+def _build_preset(kind: str, qubits: int) -> Optional[QuantumCircuit]:
+    from qiskit import QuantumCircuit
     if kind == "bell":
         qc = QuantumCircuit(2, 2)
         qc.h(0); qc.cx(0, 1); qc.measure([0,1], [0,1])
     elif kind == "ghz":
-        qubits = max(3, qubits)
         qc = QuantumCircuit(qubits, qubits)
         qc.h(0)
         for i in range(qubits-1):
@@ -74,48 +975,40 @@ async def run_preset_circuit(kind: str, qubits: int) -> str:
         qc.measure(range(qubits), range(qubits))
     elif kind == "qft":
         from qiskit.circuit.library import QFT
-        qubits = max(2, qubits)
         qc = QuantumCircuit(qubits, qubits)
         qc.compose(QFT(num_qubits=qubits), inplace=True)
         qc.measure(range(qubits), range(qubits))
     else:
-        return "Неизвестный пресет. Доступно: bell, ghz, qft."
-
-    # Prefer IBM if available
-    svc = _ibm_service()
-    if svc:
-        try:
-            backend = svc.backends(simulator=False, operational=True)[0]
-            sampler = Sampler(mode=backend)
-            job = sampler.run([qc], shots=1024)
-            res = job.result()
-            counts = res[0].data.meas.get_counts()
-            return f"🧪 IBM ({backend.name}):\n{_format_counts(counts)}"
-        except Exception:
-            pass
+        return None
+    return qc
 
-    # Fallback: local Aer
-    counts = _simulate_counts(qc, shots=1024)
-    return f"🧪 AerSimulator (local):\n{_format_counts(counts)}"
+# build_preset / parse_qasm import Qiskit on first use and build synchronously: call them from a thread
+def build_preset(kind: str, qubits: int) -> Optional[QuantumCircuit]:
+    load_sdk()
+    kind = kind.lower()
+    qubits = {"bell": 2, "ghz": max(3, qubits), "qft": max(2, qubits)}.get(kind, qubits)
+    return _cached_circuit(_cache_key("preset", kind, qubits), lambda: _build_preset(kind, qubits))
 
-async def run_openqasm(qasm_text: str) -> str:
+def parse_qasm(qasm_text: str) -> QuantumCircuit:
+    load_sdk()
     from qiskit.qasm3 import loads as qasm3_loads
+    return _cached_circuit(_cache_key("qasm", qasm_text), lambda: qasm3_loads(qasm_text))
+
+# Identical circuits already running share that run instead of simulating or submitting twice
+_flight = SingleFlight("quantum")
+
+def _execute_once(qc: QuantumCircuit, exact: bool = False, profile: Optional[str] = None):
+    return _flight.do(f"{qc.metadata['cache_key']}:{exact}:{profile}", lambda: _execute(qc, exact, profile))
+
+async def run_preset_circuit(kind: str, qubits: int, exact: bool = False, profile: Optional[str] = None) -> str:
+    qc = await asyncio.to_thread(build_preset, kind, qubits)
+    if qc is None:
+        return "Неизвестный пресет. Доступно: bell, ghz, qft."
+    return await _execute_once(qc, exact, profile)
+
+async def run_openqasm(qasm_text: str, exact: bool = False, profile: Optional[str] = None) -> str:
     try:
-        qc = qasm3_loads(qasm_text)
+        qc = await asyncio.to_thread(parse_qasm, qasm_text)
     except Exception as e:
         return f"Ошибка парсинга OpenQASM 3.0: {e}"
-
-    svc = _ibm_service()
-    if svc:
-        try:
-            backend = svc.backends(simulator=False, operational=True)[0]
-            sampler = Sampler(mode=backend)
-            job = sampler.run([qc], shots=1024)
-            res = job.result()
-            counts = res[0].data.meas.get_counts()
-            return f"🧪 IBM ({backend.name}):\n{_format_counts(counts)}"
-        except Exception:
-            pass
-
-    counts = _simulate_counts(qc, shots=1024)
-    return f"🧪 AerSimulator (local):\n{_format_counts(counts)}"
+    return await _execute_once(qc, exact, profile)
@@ -0,0 +1,35 @@
+import time, threading, logging
+from contextlib import contextmanager
+from typing import Dict, Callable
+
+log = logging.getLogger(__name__)
+
+# Import/initialisation timings (seconds), filled at startup and on lazy first use
+timings: Dict[str, float] = {}
+_t0 = time.perf_counter()
+
+@contextmanager
+def timed(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - t0
+
+def since_start() -> float:
+    return time.perf_counter() - _t0
+
+def report() -> str:
+    items = sorted(timings.items(), key=lambda kv: kv[1], reverse=True)
+    return "⏱️ Загрузка: " + (", ".join(f"{k} {v * 1000:.0f}ms" for k, v in items) or "—")
+
+def prewarm(*loaders: Callable[[], None]):
+    # Load heavy SDKs in a background thread once the bot is already polling
+    def run():
+        for load in loaders:
+            try:
+                load()
+            except Exception:
+                log.exception("prewarm failed: %s", getattr(load, "__qualname__", load))
+        log.info("prewarm done: %s", report())
+    threading.Thread(target=run, name="prewarm", daemon=True).start()
@@ -1,86 +1,276 @@
-import os, urllib.parse, httpx
+import os, re, urllib.parse, asyncio, logging, httpx
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+from modules.cache import TTLCache
+from modules.metrics import track, inc
+from modules.limits import limiter, SingleFlight
 
 WIKI_LANG = os.getenv("WIKI_LANG", "ru")
 
+# /web strategy: cascade (one by one), parallel (all at once) or hedged (next provider after WEB_HEDGE_DELAY)
+WEB_MODE = os.getenv("WEB_MODE", "cascade").lower()
+WEB_ORDER = [p.strip().lower() for p in os.getenv("WEB_ORDER", "google,bing,ddg,wiki").split(",") if p.strip()]
+WEB_HEDGE_DELAY = float(os.getenv("WEB_HEDGE_DELAY", "1.5"))
+WEB_MERGE = os.getenv("WEB_MERGE", "0") == "1"
+
+log = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional `h2` package (httpx[http2])
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except Exception:
+    _HTTP2 = False
+
+# ===== Pooled clients (one per provider, reused across calls) =====
+# *_URL overrides point a provider at a local stand-in (see bench.py)
+_PROVIDERS = {
+    "google": {"timeout": float(os.getenv("GOOGLE_TIMEOUT", "20")), "http2": True, "cache_ttl": float(os.getenv("GOOGLE_CACHE_TTL", "3600")),
+               "url": os.getenv("GOOGLE_CSE_URL", "https://www.googleapis.com/customsearch/v1")},
+    "bing":   {"timeout": float(os.getenv("BING_TIMEOUT", "20")),   "http2": True, "cache_ttl": float(os.getenv("BING_CACHE_TTL", "3600")),
+               "url": os.getenv("BING_URL", "https://api.bing.microsoft.com/v7.0/search")},
+    "ddg":    {"timeout": float(os.getenv("DDG_TIMEOUT", "20")),    "http2": True, "cache_ttl": float(os.getenv("DDG_CACHE_TTL", "3600")),
+               "url": os.getenv("DDG_URL", "https://api.duckduckgo.com/")},
+    "wiki":   {"timeout": float(os.getenv("WIKI_TIMEOUT", "20")),   "http2": True, "cache_ttl": float(os.getenv("WIKI_CACHE_TTL", "86400")),
+               "url": os.getenv("WIKI_URL", "https://{lang}.wikipedia.org/api/rest_v1/page/summary/")},
+}
+_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("WEB_MAX_CONNECTIONS", "20")),
+    max_keepalive_connections=int(os.getenv("WEB_MAX_KEEPALIVE", "10")),
+    keepalive_expiry=float(os.getenv("WEB_KEEPALIVE_EXPIRY", "60")),
+)
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+def _client(provider: str) -> httpx.AsyncClient:
+    client = _clients.get(provider)
+    if client is None or client.is_closed:
+        cfg = _PROVIDERS[provider]
+        client = httpx.AsyncClient(timeout=cfg["timeout"], http2=cfg["http2"] and _HTTP2, limits=_LIMITS)
+        _clients[provider] = client
+    return client
+
+# Requests/s and burst per provider (quota-friendly defaults); <PROVIDER>_RPS / _BURST override, 0 = off
+_RATES = {"google": (1.5, 5), "bing": (3, 3), "ddg": (2, 4), "wiki": (20, 20)}
+
+async def _get(provider: str, url: str, **kwargs) -> httpx.Response:
+    # Waits for a token instead of running into the provider's 429
+    await limiter(provider, *_RATES[provider]).acquire()
+    return await _client(provider).get(url, **kwargs)
+
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+# ===== Result cache (misses are kept for WEB_CACHE_NEG_TTL only) =====
+WEB_CACHE_NEG_TTL = float(os.getenv("WEB_CACHE_NEG_TTL", "120"))
+_cache = TTLCache(int(os.getenv("WEB_CACHE_SIZE", "512")), os.getenv("WEB_CACHE_DB") or None)
+_flight = SingleFlight("web")
+
+def _norm(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+def _cached(provider: str):
+    def deco(fn):
+        @wraps(fn)
+        async def wrapper(query: str) -> str:
+            key = f"{provider}:{WIKI_LANG}:{_norm(query)}" if provider == "wiki" else f"{provider}:{_norm(query)}"
+            found, res = await _cache.aget(key)
+            if found:
+                inc("cache_hit", f"web.{provider}")
+                return res
+            inc("cache_miss", f"web.{provider}")
+            # Identical queries already in flight share that request
+            return await _flight.do(key, lambda: _fetch(provider, key, fn, query))
+        return wrapper
+    return deco
+
+async def _fetch(provider: str, key: str, fn, query: str) -> str:
+    with track(f"web.{provider}") as t:
+        res = await fn(query)
+        t.size = len(res.encode())
+    if "не настроен" not in res and res != WIKI_UNAVAILABLE:
+        await _cache.aset(key, res, _PROVIDERS[provider]["cache_ttl"] if _is_hit(res) else WEB_CACHE_NEG_TTL)
+    return res
+
+def cache_stats() -> str:
+    return "🗄️ Кэш поиска: " + _cache.stats() + f", совмещено запросов {_flight.shared}"
+
+@_cached("google")
 async def google_search(query: str) -> str:
     key = os.getenv("GOOGLE_CSE_KEY")
     cx = os.getenv("GOOGLE_CSE_CX")
     if not key or not cx:
         return "Google CSE не настроен."
-    url = "https://www.googleapis.com/customsearch/v1"
+    url = _PROVIDERS["google"]["url"]
     params = {"key": key, "cx": cx, "q": query, "num": 3}
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        items = r.json().get("items", [])
-        if not items:
-            return "Ничего не найдено (Google)."
-        lines = ["🔎 *Google* результаты:"]
-        for it in items[:3]:
-            lines.append(f"- {it.get('title')}\n{it.get('link')}")
-        return "\n".join(lines)
+    r = await _get("google", url, params=params)
+    r.raise_for_status()
+    items = r.json().get("items", [])
+    if not items:
+        return "Ничего не найдено (Google)."
+    lines = ["🔎 *Google* результаты:"]
+    for it in items[:3]:
+        lines.append(f"- {it.get('title')}\n{it.get('link')}")
+    return "\n".join(lines)
 
+@_cached("bing")
 async def bing_search(query: str) -> str:
     key = os.getenv("BING_KEY")
     if not key:
         return "Bing не настроен."
-    url = "https://api.bing.microsoft.com/v7.0/search"
+    url = _PROVIDERS["bing"]["url"]
     headers = {"Ocp-Apim-Subscription-Key": key}
     params = {"q": query, "count": 3, "textDecorations": False}
-    async with httpx.AsyncClient(timeout=20, headers=headers) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        web_pages = (r.json() or {}).get("webPages", {}).get("value", [])
-        if not web_pages:
-            return "Ничего не найдено (Bing)."
-        lines = ["🔎 *Bing* результаты:"]
-        for it in web_pages[:3]:
-            lines.append(f"- {it.get('name')}\n{it.get('url')}")
-        return "\n".join(lines)
+    r = await _get("bing", url, params=params, headers=headers)
+    r.raise_for_status()
+    web_pages = (r.json() or {}).get("webPages", {}).get("value", [])
+    if not web_pages:
+        return "Ничего не найдено (Bing)."
+    lines = ["🔎 *Bing* результаты:"]
+    for it in web_pages[:3]:
+        lines.append(f"- {it.get('name')}\n{it.get('url')}")
+    return "\n".join(lines)
 
+@_cached("ddg")
 async def ddg_instant(query: str) -> str:
-    url = "https://api.duckduckgo.com/"
+    url = _PROVIDERS["ddg"]["url"]
     params = {"q": query, "format": "json", "no_redirect": 1, "no_html": 1}
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
-        answer = data.get("AbstractText") or data.get("Answer")
-        source = data.get("AbstractURL")
-        if answer:
-            s = f"🕸️ *DDG*: {answer}"
-            if source:
-                s += f"\nИсточник: {source}"
-            return s
-        return ""
+    r = await _get("ddg", url, params=params)
+    r.raise_for_status()
+    data = r.json()
+    answer = data.get("AbstractText") or data.get("Answer")
+    source = data.get("AbstractURL")
+    if answer:
+        s = f"🕸️ *DDG*: {answer}"
+        if source:
+            s += f"\nИсточник: {source}"
+        return s
+    return ""
+
+WIKI_UNAVAILABLE = "Википедия временно недоступна, попробуй позже."
 
+@_cached("wiki")
 async def wiki_summary(query: str) -> str:
     title = urllib.parse.quote(query)
-    url = f"https://{WIKI_LANG}.wikipedia.org/api/rest_v1/page/summary/{title}"
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.get(url)
-        if r.status_code != 200:
-            return "Не нашёл страницу в Википедии."
-        jd = r.json()
-        extract = jd.get("extract")
-        page = jd.get("content_urls", {}).get("desktop", {}).get("page")
-        if extract:
-            base = f"📚 *Wikipedia*: {extract}"
-            if page:
-                base += f"\nСтраница: {page}"
-            return base
-        return "Нет краткого описания на Википедии."
+    url = _PROVIDERS["wiki"]["url"].format(lang=WIKI_LANG) + title
+    r = await _get("wiki", url)
+    if r.status_code == 404:
+        return "Не нашёл страницу в Википедии."
+    if r.status_code != 200:
+        # 429/5xx are transient: not cached, so the next request tries again
+        log.warning("wiki HTTP %d", r.status_code)
+        return WIKI_UNAVAILABLE
+    jd = r.json()
+    extract = jd.get("extract")
+    page = jd.get("content_urls", {}).get("desktop", {}).get("page")
+    if extract:
+        base = f"📚 *Wikipedia*: {extract}"
+        if page:
+            base += f"\nСтраница: {page}"
+        return base
+    return "Нет краткого описания на Википедии."
+
+_SEARCHERS = {
+    "google": google_search,
+    "bing": bing_search,
+    "ddg": ddg_instant,
+    "wiki": wiki_summary,
+}
+_MISSES = (
+    "Google CSE не настроен.", "Ничего не найдено (Google).",
+    "Bing не настроен.", "Ничего не найдено (Bing).",
+    "Не нашёл страницу в Википедии.", "Нет краткого описания на Википедии.", WIKI_UNAVAILABLE,
+)
+
+def _is_hit(res: str) -> bool:
+    return bool(res) and not res.startswith(_MISSES)
+
+async def _run_provider(name: str, query: str) -> str:
+    try:
+        return await _SEARCHERS[name](query)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.warning("%s search failed: %s", name, type(e).__name__)
+        return ""
+
+def _pick(order: List[str], tasks: Dict[str, asyncio.Task]) -> Optional[str]:
+    # First hit by priority: a provider wins only once every higher-priority one has missed
+    for name in order:
+        task = tasks.get(name)
+        if task is None or not task.done():
+            return None
+        res = task.result()
+        if _is_hit(res):
+            return res
+    return None
+
+def _entries(res: str) -> List[Tuple[str, str]]:
+    # Split a provider answer into (url, block) pairs for deduplication
+    lines = res.split("\n")
+    if lines[0].startswith("🔎"):
+        return [(lines[i + 1], lines[i] + "\n" + lines[i + 1]) for i in range(1, len(lines) - 1, 2)]
+    urls = re.findall(r"https?://\S+", res)
+    return [(urls[0] if urls else res, res)]
+
+def _merge(results: List[str]) -> str:
+    seen, blocks = set(), []
+    for res in results:
+        for url, block in _entries(res):
+            if url not in seen:
+                seen.add(url)
+                blocks.append(block)
+    return "\n".join(["🔎 *Web* результаты:"] + blocks)
+
+async def _fan_out(query: str, order: List[str], delay: float) -> Optional[str]:
+    tasks: Dict[str, asyncio.Task] = {}
+    pending = set()
+    loop = asyncio.get_running_loop()
+    try:
+        for i, name in enumerate(order):
+            task = asyncio.create_task(_run_provider(name, query))
+            tasks[name] = task
+            pending.add(task)
+            if i == len(order) - 1:
+                break
+            # Hedging: give the providers already in flight `delay` seconds before launching the next one
+            deadline = loop.time() + delay
+            while pending and (timeout := deadline - loop.time()) > 0:
+                _, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                hit = _pick(order, tasks)
+                if hit:
+                    return hit
+        while pending:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            hit = _pick(order, tasks)
+            if hit:
+                return hit
+        return None
+    finally:
+        for task in tasks.values():
+            if not task.done():
+                task.cancel()
+
+async def _cascade(query: str, order: List[str]) -> Optional[str]:
+    for name in order:
+        res = await _run_provider(name, query)
+        if _is_hit(res):
+            return res
+    return None
 
 async def web_search(query: str) -> str:
-    # Try Google, then Bing, then DDG + Wiki
-    g = await google_search(query)
-    if not g.startswith("Google CSE не настроен.") and not g.startswith("Ничего не найдено (Google)."):
-        return g
-    b = await bing_search(query)
-    if not b.startswith("Bing не настроен.") and not b.startswith("Ничего не найдено (Bing)."):
-        return b
-    d = await ddg_instant(query)
-    if d:
-        return d
-    w = await wiki_summary(query)
-    return w
+    order = [name for name in WEB_ORDER if name in _SEARCHERS] or list(_SEARCHERS)
+    if WEB_MERGE:
+        results = await asyncio.gather(*(_run_provider(name, query) for name in order))
+        hits = [res for res in results if _is_hit(res)]
+        return _merge(hits) if hits else "Ничего не найдено."
+    if WEB_MODE == "parallel":
+        res = await _fan_out(query, order, 0)
+    elif WEB_MODE == "hedged":
+        res = await _fan_out(query, order, WEB_HEDGE_DELAY)
+    else:
+        res = await _cascade(query, order)
+    return res or "Ничего не найдено."